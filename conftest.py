@@ -0,0 +1,2 @@
+# Puts the repository root on sys.path so tests/ can import the flat
+# final_app_* modules
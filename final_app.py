@@ -1,9 +1,12 @@
 from final_app_homepage import homepage
 from final_app_tabs import all_tabs
+from final_app_warmup import WARMUP_AT_START, start_server
 import streamlit as st
 from streamlit_lottie import st_lottie
 
 st.set_page_config(page_title="Breast Cancer Insights", page_icon="🔬", layout="wide")
+if WARMUP_AT_START:
+    start_server()
 
 if "page" not in st.session_state:
     st.session_state.page = "Home"
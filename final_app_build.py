@@ -0,0 +1,324 @@
+import argparse
+import io
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+from final_app_clustering import clustering_features, encode_cases, encode_features, num_clusters, score_k
+from final_app_cube import CUBE_DIMENSIONS
+from final_app_km import compact_survival
+from final_app_storage import (
+    SURVIVAL_SCHEMA, DatasetWriter, columnar_path, columnar_is_current, content_hash, csv_path, dataset_version,
+    read_dataset, record_source, write_dataset, write_stats,
+)
+
+# Offline build of the tables the dashboard reads, straight from the raw
+# SEER extract:
+#
+#   python final_app_build.py seer [--jobs N] [--block-mb MB] [--csv] [--full]
+#
+# seer.csv is cut into line-aligned byte blocks that are parsed and reduced
+# by a pool of worker processes. At most a few blocks are in flight at a
+# time, so memory stays bounded however large the extract grows.
+#
+# Builds are incremental. The merged patient counts are kept as the
+# 'patient counts' dataset and '<source>.build.json' records how many bytes
+# of the extract they cover together with a hash of those bytes. When the
+# extract has only grown (new diagnosis years appended) just the new bytes
+# are parsed and their counts added to the affected slices; any other
+# change falls back to a full rebuild.
+#
+# The clustered genome table comes from the raw TCGA extract:
+#
+#   python final_app_build.py genome [--k K] [--sweep K ...] [--jobs N] [--csv]
+#
+# Each case's clustering_features are encoded and standardized, KMeans is
+# fitted for every k of the sweep in parallel, and the inertia and
+# silhouette of each are reported. The labels for --k are joined back onto
+# the expression rows and written as 'genome_cluster'. Fits use a fixed
+# seed, so the same extract always gives the same clusters.
+
+SURVIVAL_COLUMNS = list(SURVIVAL_SCHEMA)
+
+# Finest grain of the patient counts; every count table and the dashboard's
+# count cube are roll-ups of it
+COUNT_KEYS = CUBE_DIMENSIONS
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        header = f.readline()
+    return pd.read_csv(io.BytesIO(header)).columns.tolist(), len(header)
+
+
+def byte_blocks(path, start, block_size):
+    # (start, end) offsets that always fall on line boundaries
+    size = os.path.getsize(path)
+    blocks = []
+    with open(path, 'rb') as f:
+        while start < size:
+            f.seek(min(start + block_size, size))
+            if f.tell() < size:
+                f.readline()
+            end = f.tell()
+            blocks.append((start, end))
+            start = end
+    return blocks
+
+
+def read_block(path, names, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    usecols = [c for c in names if c in SURVIVAL_SCHEMA]
+    dtype = {c: 'category' for c in usecols if SURVIVAL_SCHEMA[c] == 'category'}
+    return pd.read_csv(io.BytesIO(data), header=None, names=names, usecols=usecols, dtype=dtype)
+
+
+def count_patients(df):
+    return df.groupby(COUNT_KEYS, observed=True, dropna=False).size()
+
+
+def _process_block(path, names, start, end):
+    chunk = read_block(path, names, start, end)[SURVIVAL_COLUMNS]
+    return count_patients(chunk), compact_survival(chunk), chunk
+
+
+def merge_counts(parts):
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return pd.Series(0, index=pd.MultiIndex.from_tuples([], names=COUNT_KEYS), dtype='int64')
+    counts = pd.concat(parts)
+    return counts.groupby(level=COUNT_KEYS, observed=True, dropna=False).sum()
+
+
+def merge_survival_counts(parts):
+    # Categories differ between blocks; align them to strings before summing
+    parts = [p.astype({c: object for c in SURVIVAL_COLUMNS if c in p and p[c].dtype == 'category'}) for p in parts if len(p)]
+    if not parts:
+        return pd.DataFrame(columns=SURVIVAL_COLUMNS + ['count'])
+    return compact_survival(pd.concat(parts, ignore_index=True))
+
+
+def derived_tables(counts):
+    counts = counts.reset_index(name='count')
+    return {
+        'patients by year and age': counts.groupby(['year_of_diagnosis', 'age_group'], observed=True)['count']
+            .sum().rename('Age').reset_index(),
+        'laterality vs tumor site alluvial': counts.groupby(['laterality', 'tumor_site'], observed=True)['count']
+            .sum().reset_index(),
+        'age vs site radar data': counts.groupby(['age_group', 'tumor_site'], observed=True)['count']
+            .sum().unstack(fill_value=0).reset_index().rename_axis(columns=None),
+    }
+
+
+def scan(path, blocks, names, jobs, on_result):
+    # Runs _process_block over the blocks in order with a bounded window
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for start, end in blocks:
+            pending.append(pool.submit(_process_block, path, names, start, end))
+            if len(pending) >= 2 * jobs:
+                on_result(*pending.popleft().result())
+        while pending:
+            on_result(*pending.popleft().result())
+
+
+def write_csv(name, df):
+    version = dataset_version(name)
+    df.to_csv(csv_path(name), index=False)
+    # The columnar copy holds the same rows: record it as current for the
+    # new CSV, with the same version
+    record_source(name, version=version)
+    write_stats(name, df)
+
+
+def write_tables(tables, also_csv):
+    for name, df in tables.items():
+        write_dataset(name, df)
+        if also_csv:
+            write_csv(name, df)
+        print(f"  {name}: {len(df):,} rows")
+
+
+def manifest_path(source):
+    return source + '.build.json'
+
+
+def read_manifest(source):
+    try:
+        with open(manifest_path(source)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_manifest(source, path, names):
+    manifest = {
+        'columns': names,
+        'keys': COUNT_KEYS,
+        'bytes': os.path.getsize(path),
+        'sha256': content_hash(path),
+    }
+    with open(manifest_path(source), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def resume_offset(source, path, names):
+    # Byte offset up to which the previous build is still valid, or None
+    manifest = read_manifest(source)
+    if manifest is None or manifest['columns'] != names or manifest.get('keys') != COUNT_KEYS:
+        return None
+    if not all(columnar_is_current(n) for n in ('patient counts', 'survival counts', 'survival df')):
+        return None
+    if os.path.getsize(path) < manifest['bytes']:
+        return None
+    if content_hash(path, manifest['bytes']) != manifest['sha256']:
+        return None
+    return manifest['bytes']
+
+
+def load_counts():
+    counts = pd.read_parquet(columnar_path('patient counts'))
+    return counts.set_index(COUNT_KEYS)['count']
+
+
+def build_seer(source='seer', jobs=None, block_mb=64, also_csv=False, full=False):
+    started = time.perf_counter()
+    jobs = jobs or os.cpu_count() or 1
+    path = csv_path(source)
+    names, header_size = read_header(path)
+    missing = set(SURVIVAL_COLUMNS) - set(names)
+    if missing:
+        raise SystemExit(f"{path} is missing columns: {', '.join(sorted(missing))}")
+
+    offset = None if full else resume_offset(source, path, names)
+    if offset == os.path.getsize(path):
+        print(f"{path}: up to date")
+        return
+    blocks = byte_blocks(path, offset or header_size, block_mb * 2**20)
+    mode = 'full build' if offset is None else f'appending from byte {offset:,}'
+    print(f"{path}: {mode}, {len(blocks)} blocks on {jobs} workers")
+
+    parts = []
+    new_parts = []
+    survival_parts = []
+    previous = columnar_path('survival df') + '.prev'
+    if offset is not None:
+        parts.append(load_counts())
+        survival_parts.append(pd.read_parquet(columnar_path('survival counts')))
+        os.replace(columnar_path('survival df'), previous)
+    try:
+        with DatasetWriter('survival df', SURVIVAL_COLUMNS) as survival:
+            if offset is not None:
+                survival.copy_from(previous)
+
+            def on_result(counts, survival_counts, rows):
+                new_parts.append(counts)
+                survival_parts.append(survival_counts)
+                survival.write(rows)
+            scan(path, blocks, names, jobs, on_result)
+    except BaseException:
+        if offset is not None:
+            os.replace(previous, columnar_path('survival df'))
+        raise
+    if offset is not None:
+        os.remove(previous)
+    print(f"  survival df: {survival.rows:,} rows")
+    if also_csv:
+        write_csv('survival df', pd.read_parquet(columnar_path('survival df')))
+    survival_counts = write_dataset('survival counts', merge_survival_counts(survival_parts))
+    print(f"  survival counts: {len(survival_counts):,} rows")
+
+    new_counts = merge_counts(new_parts)
+    if offset is not None:
+        years = sorted(new_counts.index.get_level_values('year_of_diagnosis').dropna().unique())
+        print(f"  updated years: {', '.join(str(int(y)) for y in years)}")
+    counts = merge_counts(parts + [new_counts])
+    write_dataset('patient counts', counts.reset_index(name='count'))
+    write_tables(derived_tables(counts), also_csv)
+    write_manifest(source, path, names)
+    print(f"done in {time.perf_counter() - started:.1f} s")
+
+
+def sweep_clusters(features, ks, jobs, seed):
+    with ProcessPoolExecutor(max_workers=min(jobs, len(ks))) as pool:
+        return {k: (inertia, silhouette, labels) for k, inertia, silhouette, labels
+                in pool.map(score_k, repeat(features), ks, repeat(seed))}
+
+
+def build_genome(source='genome', output='genome_cluster', k=num_clusters, sweep=(), site_column=None,
+                 jobs=None, seed=0, also_csv=False):
+    started = time.perf_counter()
+    jobs = jobs or os.cpu_count() or 1
+    df = read_dataset(source)
+    site_column = site_column or 'site_of_resection_or_biopsy'
+    missing = {'Case', 'Gene', 'Expression', 'Cancer Stage', site_column, 'age_at_diagnosis'} - set(df.columns)
+    if missing:
+        raise SystemExit(f"{source} is missing columns: {', '.join(sorted(missing))}")
+
+    cases = encode_cases(df.drop_duplicates('Case')[['Case', 'Cancer Stage', site_column, 'age_at_diagnosis']],
+                         site_column)
+    positions, features = encode_features(cases)
+    if len(positions) < len(cases):
+        print(f"  {len(cases) - len(positions):,} cases without {', '.join(clustering_features)} are left out")
+    ks = sorted({n for n in list(sweep) + [k] if 1 <= n <= len(positions)})
+    if k not in ks:
+        raise SystemExit(f"cannot make {k} clusters of {len(positions):,} cases")
+    print(f"{source}: {len(positions):,} cases, k in {ks} on {min(jobs, len(ks))} workers")
+
+    results = sweep_clusters(features, ks, jobs, seed)
+    best = max(ks, key=lambda n: -np.inf if np.isnan(results[n][1]) else results[n][1])
+    print(f"  {'k':>4} {'inertia':>12} {'silhouette':>10}")
+    for n in ks:
+        inertia, silhouette, _ = results[n]
+        marks = (' best silhouette' if n == best else '') + (' written' if n == k else '')
+        print(f"  {n:>4} {inertia:>12.1f} {silhouette:>10.3f}{marks}")
+
+    clustered = cases.iloc[positions][['Case', 'Cancer Stage Encoded', 'Site Encoded']]
+    clustered = clustered.assign(Cluster=results[k][2])
+    out = df.merge(clustered, on='Case', how='inner')
+    out = write_dataset(output, out)
+    if also_csv:
+        write_csv(output, out)
+    print(f"  {output}: {len(out):,} rows")
+    print(f"done in {time.perf_counter() - started:.1f} s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the dashboard tables from the raw data.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seer = commands.add_parser('seer', help="derived SEER tables from seer.csv")
+    seer.add_argument('--source', default='seer', help="raw extract name without .csv")
+    seer.add_argument('--jobs', type=int, default=None, help="worker processes (default: all cores)")
+    seer.add_argument('--block-mb', type=int, default=64, help="size of each parsed block")
+    seer.add_argument('--csv', action='store_true', help="also write CSV copies of the outputs")
+    seer.add_argument('--full', action='store_true', help="ignore the previous build and start over")
+
+    genome = commands.add_parser('genome', help="clustered genome table from genome.csv")
+    genome.add_argument('--source', default='genome', help="raw extract name without .csv")
+    genome.add_argument('--output', default='genome_cluster', help="output dataset name")
+    genome.add_argument('--k', type=int, default=num_clusters, help="number of clusters written")
+    genome.add_argument('--sweep', type=int, nargs='*', default=[10, 20, 30, 40, 50, 60],
+                        help="values of k to evaluate")
+    genome.add_argument('--site-column', default=None, help="column behind 'Site Encoded'")
+    genome.add_argument('--jobs', type=int, default=None, help="worker processes (default: all cores)")
+    genome.add_argument('--seed', type=int, default=0, help="KMeans random state")
+    genome.add_argument('--csv', action='store_true', help="also write a CSV copy of the output")
+
+    args = parser.parse_args(argv)
+    if args.command == 'seer':
+        build_seer(args.source, args.jobs, args.block_mb, args.csv, args.full)
+    elif args.command == 'genome':
+        build_genome(args.source, args.output, args.k, args.sweep, args.site_column, args.jobs, args.seed, args.csv)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Process-wide result caches shared by every session.
+#
+# LRUCache bounds its contents by an estimate of their size in bytes and
+# evicts the least recently used results first. Keys should be built with
+# normalized_filters() so that the same selection made in a different order
+# maps to the same entry.
+#
+# SingleFlight coalesces concurrent identical computations: while one caller
+# computes a key, later callers with the same key wait for its result
+# instead of starting their own. LRUCache.get_or_compute goes through one,
+# so a burst of sessions asking for the same uncached result costs a single
+# computation.
+
+_MISSING = object()
+
+
+def nbytes(value):
+    # Rough in-memory size of a result made of arrays, frames and containers
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(nbytes(k) + nbytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(nbytes(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def normalized_filters(filters):
+    # Canonical, hashable form of a sidebar filter dict: multiselect lists
+    # are sorted, ranges (tuples) keep their order, nested dicts are
+    # normalized in turn and other values are kept as they are
+    normalized = []
+    for col, selected in sorted(filters.items()):
+        if isinstance(selected, tuple):
+            selected = tuple(v.item() if hasattr(v, 'item') else v for v in selected)
+        elif isinstance(selected, dict):
+            selected = normalized_filters(selected)
+        elif selected is None or isinstance(selected, (list, set, frozenset)):
+            selected = tuple(sorted(selected or (), key=str))
+        elif hasattr(selected, 'item'):
+            selected = selected.item()
+        normalized.append((col, selected))
+    return tuple(normalized)
+
+
+class _Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self.calls = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def do(self, key, compute):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+        try:
+            call.value = compute()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.value
+
+    def stats(self):
+        with self.lock:
+            return {'in_flight': len(self.calls), 'executed': self.executed, 'coalesced': self.coalesced}
+
+
+class LRUCache:
+
+    def __init__(self, max_bytes, sizeof=nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.flight = SingleFlight()
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.flight.do(key, lambda: self._compute(key, compute))
+        return value
+
+    def _compute(self, key, compute):
+        # A caller that missed just before another finished the same key
+        # finds it here instead of computing it again
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key][0]
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+        stats.update(self.flight.stats())
+        return stats
@@ -0,0 +1,113 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+from final_app_cache import LRUCache
+
+# Re-clustering of the filtered Genome cohort.
+#
+# The stored 'Cluster' labels were fitted on the whole cohort. When a user
+# asks for clusters of the cases they filtered, the fit runs in a small
+# process pool shared by every session: the script thread only submits the
+# job and checks on it at later reruns, so a fit never blocks the app.
+# Finished labels are kept in an LRU cache keyed by the data version, the
+# filter selections, k and the features.
+#
+# The stored labels themselves come from the offline build
+# (python final_app_build.py genome), which encodes the raw cases with
+# encode_cases() and fits KMeans for a range of k with score_k().
+
+clustering_features = ['age_at_diagnosis', 'Cancer Stage Encoded', 'Site Encoded']
+num_clusters = 50
+
+
+def encode_cases(cases, site_column='site_of_resection_or_biopsy'):
+    # Integer codes of the categorical clustering features, in sorted label
+    # order; a missing label is a level of its own
+    cases = cases.copy()
+    cases['Cancer Stage Encoded'] = LabelEncoder().fit_transform(cases['Cancer Stage'].astype(str))
+    cases['Site Encoded'] = LabelEncoder().fit_transform(cases[site_column].astype(str))
+    return cases
+
+
+def encode_features(cases, features=clustering_features):
+    # Standardized feature matrix of the cases with every feature present,
+    # and the positions of those cases in `cases`
+    values = cases[features].to_numpy(dtype=float)
+    positions = np.flatnonzero(~np.isnan(values).any(axis=1))
+    if not len(positions):
+        return positions, np.empty((0, len(features)))
+    return positions, StandardScaler().fit_transform(values[positions])
+
+
+def fit_clusters(features, k, seed=0):
+    # Runs in a worker process
+    model = MiniBatchKMeans(n_clusters=min(k, len(features)), random_state=seed, n_init=3,
+                            batch_size=min(1024, len(features)))
+    return model.fit_predict(features).astype(np.int16)
+
+
+def score_k(features, k, seed=0, sample_size=5000):
+    # Full KMeans fit for one k, with its inertia and silhouette (on a fixed
+    # sample of the cases when there are many). Runs in a worker process.
+    model = KMeans(n_clusters=k, n_init=10, random_state=seed).fit(features)
+    labels = model.labels_.astype(np.int16)
+    if 1 < len(np.unique(labels)) < len(features):
+        silhouette = silhouette_score(features, labels, sample_size=min(sample_size, len(features)),
+                                      random_state=seed)
+    else:
+        silhouette = np.nan
+    return k, model.inertia_, silhouette, labels
+
+
+class ClusterJobs:
+
+    def __init__(self, workers=2, max_pending=4, max_bytes=16 * 2**20, retry_after=60):
+        # Workers are spawned, not forked: forking the threaded server
+        # process could copy locks held by its other threads
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.max_pending = max_pending
+        self.pending = {}
+        self.results = LRUCache(max_bytes)
+        # Failed keys with the time they failed; they may be retried after
+        # `retry_after` seconds
+        self.failed = {}
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+
+    def request(self, key, features, k):
+        # Never waits: returns ('done', labels), or ('running', None) while
+        # the job is queued or fitting, ('busy', None) when too many jobs are
+        # already pending and ('failed', None) when the fit raised
+        labels = self.results.get(key)
+        if labels is not None:
+            return 'done', labels
+        with self.lock:
+            if key in self.failed:
+                if time.monotonic() - self.failed[key] < self.retry_after:
+                    return 'failed', None
+                del self.failed[key]
+            if key in self.pending:
+                return 'running', None
+            if len(self.pending) >= self.max_pending:
+                return 'busy', None
+            future = self.pool.submit(fit_clusters, features, k)
+            self.pending[key] = future
+        future.add_done_callback(lambda f: self._finish(key, f))
+        return 'running', None
+
+    def _finish(self, key, future):
+        # Moves a finished job out of the pending set, whether or not any
+        # session asks for it again
+        if future.exception() is None:
+            self.results.put(key, future.result())
+        with self.lock:
+            if future.exception() is not None:
+                self.failed[key] = time.monotonic()
+            self.pending.pop(key, None)
@@ -1,6 +1,17 @@
+import logging
+import re
+import threading
 import streamlit as st
 import pandas as pd
+from final_app_storage import SURVIVAL_SCHEMA, dataset_version, read_dataset, read_stats
+from final_app_filters import FilterIndex
+from final_app_cube import CountCube
+from final_app_cache import LRUCache
+from final_app_genome_data import ClusterGeneStats, read_matrix
+from final_app_warmup import from_snapshot, import_module, report
+from final_app_executor import ComputeExecutor
 
+# Fallback filter options, used when the data has no statistics catalog
 min_year, max_year = 1975, 2021
 
 age_group_options = [
@@ -76,11 +87,300 @@ def tabs():
         st.rerun()
 
 
+def natural_key(value):
+    # Sorts '5-14 yrs' before '15-24 yrs'
+    return [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', str(value))]
+
+
+def stage_key(value):
+    # Clinical order: 0, then I to IV with their substages (IIA before IIB),
+    # then any value that is not a stage
+    match = re.fullmatch(r'(0|IV|III|II|I)(.*)', str(value))
+    if match is None:
+        return (1, str(value))
+    return (0, ['0', 'I', 'II', 'III', 'IV'].index(match.group(1)), match.group(2))
+
+
+@st.cache_resource(max_entries=32)
+def _load_stats(path, version):
+    return read_stats(path)
+
+
+def load_stats(path):
+    # Column statistics catalog of a dataset (see final_app_storage)
+    return _load_stats(path, dataset_version(path))
+
+
+def catalog_options(path, col, fallback, remove=('Unknown',), key=None):
+    # Distinct values of a column from the catalog, sorted; the fallback list
+    # when the dataset or its catalog does not have them
+    stats = load_stats(path) if dataset_version(path) is not None else None
+    column = (stats or {}).get('columns', {}).get(col, {})
+    if 'values' not in column:
+        return fallback
+    return sorted((v for v, _ in column['values'] if v is not None and v not in remove), key=key)
+
+
+def catalog_range(path, col, fallback):
+    stats = load_stats(path) if dataset_version(path) is not None else None
+    column = (stats or {}).get('columns', {}).get(col, {})
+    return (column['min'], column['max']) if 'min' in column else fallback
+
+
+def filter_source():
+    # Dataset the SEER sidebar options are read from: the patient counts,
+    # otherwise the patient-level survival table
+    for source in cube_sources:
+        if dataset_version(source) is not None:
+            return source
+    return cube_sources[0]
+
+
+def filter_options():
+    # Year bounds and multiselect options of the SEER sidebar
+    source = filter_source()
+    return {
+        'year_of_diagnosis': tuple(catalog_range(source, 'year_of_diagnosis', (min_year, max_year))),
+        'age_group': catalog_options(source, 'age_group', age_group_options, key=natural_key),
+        'tumor_site': catalog_options(source, 'tumor_site', tumor_site_options),
+        'adjusted_ajcc_6th_stage': catalog_options(source, 'adjusted_ajcc_6th_stage', stage_options, key=stage_key),
+    }
+
+
+def default_filters(options):
+    # The filter dict of an untouched sidebar
+    return {col: values if col == 'year_of_diagnosis' else [] for col, values in options.items()}
+
+
+def sidebar_filters():
+    start_survival_warmer()
+    options = filter_options()
+    first_year, last_year = options['year_of_diagnosis']
+    year_range = st.sidebar.slider("Year Range", min_value=first_year, max_value=last_year, value=(first_year, last_year))
+    age_groups_selected = st.sidebar.multiselect("Age Groups", options['age_group'])
+    tumor_sites_selected = st.sidebar.multiselect("Tumor Site", options['tumor_site'])
+    stage_selected = st.sidebar.multiselect("Stage", options['adjusted_ajcc_6th_stage'])
+    return {
+        'year_of_diagnosis': year_range,
+        'age_group': age_groups_selected,
+        'tumor_site': tumor_sites_selected,
+        'adjusted_ajcc_6th_stage': stage_selected,
+    }
+
+
 def col_filter_options(df, col, remove = set()):
     remove = remove.union({'Unknown'})
     return ['All'] + sorted(list(set(df[col]) - remove))
 
 
-@st.cache_data()
 def load_data(path):
-    return pd.read_csv(path+'.csv')
\ No newline at end of file
+    return _load_data(path, dataset_version(path))
+
+
+# Keyed on the file version as well as the name, so a refreshed dataset is
+# picked up by the running server on the next rerun. The frames are shared by
+# every session and must be treated as read-only.
+@st.cache_resource(max_entries=32)
+def _load_data(path, version):
+    return read_dataset(path)
+
+
+def drop_missing(df):
+    return df.dropna().reset_index(drop=True)
+
+
+def melt_radar(df):
+    return df.melt(id_vars='age_group', var_name='tumor_site', value_name='count')
+
+
+def compact_survival_df(df):
+    # Rows missing a value in any column are dropped before the other
+    # columns are left out, as drop_missing did for the survival tab
+    from final_app_km import compact_survival
+    return compact_survival(drop_missing(df)[[c for c in df.columns if c in SURVIVAL_SCHEMA]])
+
+
+# Reshapes applied once to a dataset before it is indexed
+prepare_steps = {
+    'drop_missing': drop_missing,
+    'melt_radar': melt_radar,
+    'compact_survival': compact_survival_df,
+}
+
+
+def _build_indexed(path, version, prepare):
+    # A prepare step replaces the frame, so the raw one is read uncached
+    # and freed once the prepared frame is built
+    if prepare is None:
+        df = _load_data(path, version)
+    else:
+        df = prepare_steps[prepare](read_dataset(path))
+    return df, FilterIndex(df)
+
+
+@st.cache_resource(max_entries=32)
+def _load_indexed(path, version, prepare):
+    return from_snapshot(('indexed', path, prepare), version, lambda: _build_indexed(path, version, prepare))
+
+
+def filter_data(path, filters, prepare=None):
+    # Filters a dataset (optionally reshaped once by a prepare step) through
+    # its bitmap index
+    df, index = indexed_data(path, prepare)
+    return index.apply(df, filters)
+
+
+def survival_source():
+    # Weighted survival rows (one per distinct patient profile, with a
+    # 'count'): the build's 'survival counts' when present, otherwise
+    # 'survival df' compacted once per data version
+    if dataset_version('survival counts') is not None:
+        return 'survival counts', None
+    return 'survival df', 'compact_survival'
+
+
+def survival_data(filters):
+    path, prepare = survival_source()
+    return filter_data(path, filters, prepare)
+
+
+def indexed_data(path, prepare=None):
+    # A dataset after its prepare step, with its filter index
+    return _load_indexed(path, dataset_version(path), prepare)
+
+
+@st.cache_resource
+def curve_cache():
+    # Fitted Kaplan-Meier results shared by all sessions
+    cache = LRUCache(max_bytes=64 * 2**20)
+    report('curve cache', cache.stats)
+    return cache
+
+
+@st.cache_resource
+def compute_executor():
+    # Bounded pool the heavy tab computations run on, shared by all sessions
+    executor = ComputeExecutor()
+    report('compute executor', executor.stats)
+    return executor
+
+
+def run_compute(view, compute, poll=0.1):
+    # Runs compute() on the shared executor and waits for its result. While
+    # waiting, an empty placeholder is refreshed every `poll` seconds: each
+    # refresh lets Streamlit stop this run when a newer rerun of the session
+    # is queued, and the job is then cancelled.
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    owner = (ctx.session_id if ctx is not None else None, view)
+    executor = compute_executor()
+    job = executor.submit(owner, compute)
+    placeholder = st.empty()
+    try:
+        while not job.wait(poll):
+            placeholder.empty()
+    except BaseException:
+        executor.cancel(owner, job)
+        raise
+    return job.result()
+
+
+logger = logging.getLogger(__name__)
+
+
+def _warm_survival():
+    try:
+        import_module('final_app_survival_analysis').warm_survival_views()
+    except Exception:
+        logger.exception("survival warm-up failed")
+
+
+@st.cache_resource(max_entries=1)
+def _survival_warmer(path, version):
+    # The Survival module is imported, and the data loaded and indexed, on
+    # the warmer's own thread; the fits themselves run on the compute
+    # executor
+    thread = threading.Thread(target=_warm_survival, name='survival-warmer', daemon=True)
+    thread.start()
+    return thread
+
+
+def start_survival_warmer():
+    # Precomputes the common Survival views in the background, once per
+    # version of the survival data: the server warm-up starts it, and the
+    # SEER sidebar starts it again after a refresh
+    path, _ = survival_source()
+    version = dataset_version(path)
+    if version is not None:
+        _survival_warmer(path, version)
+
+
+# The count cube comes from the build's patient counts (python
+# final_app_build.py seer) when they exist. Without them each chart counts
+# from the table shipped for it, filtered on the columns that table has, as
+# the tabs always did: (count column, prepare step) of each
+cube_sources = ['patient counts', 'survival df']
+chart_tables = {
+    'patients by year and age': ('Age', None),
+    'laterality vs tumor site alluvial': ('count', None),
+    'age vs site radar data': ('count', 'melt_radar'),
+}
+
+
+def _build_cube(path, version):
+    df = _load_data(path, version)
+    weight, prepare = chart_tables.get(path, ('count', None))
+    if prepare is not None:
+        df = prepare_steps[prepare](df)
+    return CountCube.from_frame(df, weight=weight if weight in df.columns else None)
+
+
+@st.cache_resource(max_entries=4)
+def _load_cube(path, version):
+    return from_snapshot(('cube', path), version, lambda: _build_cube(path, version))
+
+
+def cube_source(table):
+    # Dataset the cube for a chart's shipped `table` is built from
+    if dataset_version('patient counts') is not None:
+        return 'patient counts'
+    return table
+
+
+def load_cube(table):
+    path = cube_source(table)
+    version = dataset_version(path)
+    if version is None:
+        raise FileNotFoundError("no data for the count cube: patient counts, " + table)
+    return _load_cube(path, version)
+
+
+@st.cache_resource(max_entries=2)
+def _load_genome(path, version):
+    return read_matrix(path)
+
+
+def load_genome(path='genome_cluster'):
+    # Case x gene expression matrix with its per-case attributes
+    return _load_genome(path, dataset_version(path))
+
+
+@st.cache_resource(max_entries=2)
+def _load_genome_stats(path, version):
+    return from_snapshot(('genome_stats', path), version, lambda: ClusterGeneStats.build(_load_genome(path, version)))
+
+
+def load_genome_stats(path='genome_cluster'):
+    # Per-stratum sums and counts behind the Genome heatmap; None when there
+    # are too many strata for them to pay off
+    return _load_genome_stats(path, dataset_version(path))
+
+
+@st.cache_resource
+def cluster_jobs():
+    # Worker pool and results for re-clustering filtered Genome cases,
+    # shared by all sessions; sklearn is only imported once it is needed
+    from final_app_clustering import ClusterJobs
+    jobs = ClusterJobs()
+    report('cluster results', jobs.results.stats)
+    return jobs
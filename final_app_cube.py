@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+# Dense patient count cube behind the Demographics and Tumor charts.
+#
+# The cube holds one count per combination of CUBE_DIMENSIONS. A sidebar
+# selection keeps a subset of the labels along some axes and every chart is
+# a sum over the axes it does not show, so the cost of a rerun depends on the
+# number of label combinations, not on the number of patients. Adding a
+# dimension (e.g. 'race') to CUBE_DIMENSIONS extends the cube, the build and
+# the filters without touching the chart code.
+
+CUBE_DIMENSIONS = ['year_of_diagnosis', 'age_group', 'tumor_site', 'adjusted_ajcc_6th_stage', 'laterality']
+
+
+class CountCube:
+
+    def __init__(self, counts, labels, dimensions):
+        self.counts = counts
+        self.labels = labels
+        self.dimensions = list(dimensions)
+
+    @classmethod
+    def from_frame(cls, df, dimensions=CUBE_DIMENSIONS, weight=None):
+        # Rows with a missing label on any dimension are left out, as a
+        # groupby over the same columns would
+        dimensions = [d for d in dimensions if d in df.columns]
+        codes, labels = [], {}
+        for dim in dimensions:
+            c, uniques = pd.factorize(df[dim], sort=True)
+            codes.append(c)
+            labels[dim] = np.asarray(uniques)
+        shape = tuple(len(labels[d]) for d in dimensions)
+        keep = np.logical_and.reduce([c >= 0 for c in codes]) if codes else np.ones(len(df), dtype=bool)
+        flat = np.ravel_multi_index([c[keep] for c in codes], shape) if codes else np.zeros(keep.sum(), dtype=np.intp)
+        weights = None if weight is None else df[weight].to_numpy()[keep]
+        counts = np.bincount(flat, weights=weights, minlength=int(np.prod(shape)))
+        return cls(counts.astype(np.int64).reshape(shape), labels, dimensions)
+
+    def _axis_mask(self, dim, selected):
+        labels = self.labels[dim]
+        if isinstance(selected, tuple):
+            return (labels >= selected[0]) & (labels <= selected[1])
+        return np.isin(labels, list(selected))
+
+    def select(self, filters):
+        # Same filter dict as FilterIndex: a (lo, hi) range or a list of
+        # labels per dimension; empty lists and unknown dimensions are ignored
+        counts, labels = self.counts, dict(self.labels)
+        for dim, selected in filters.items():
+            if dim not in labels or selected is None or (not isinstance(selected, tuple) and not selected):
+                continue
+            mask = self._axis_mask(dim, selected)
+            if mask.all():
+                continue
+            counts = counts.compress(mask, axis=self.dimensions.index(dim))
+            labels[dim] = labels[dim][mask]
+        return CountCube(counts, labels, self.dimensions)
+
+    def total(self):
+        return int(self.counts.sum())
+
+    def rollup(self, dimensions, keep_zeros=False, value_name='count'):
+        # Long table of the counts summed down to `dimensions`
+        axes = [self.dimensions.index(d) for d in dimensions]
+        others = tuple(i for i in range(self.counts.ndim) if i not in axes)
+        summed = self.counts.sum(axis=others)
+        # sum() keeps the remaining axes in cube order
+        order = sorted(axes)
+        summed = np.transpose(summed, [order.index(a) for a in axes])
+        if keep_zeros:
+            index = np.indices(summed.shape).reshape(len(axes), -1)
+        else:
+            index = np.nonzero(summed)
+        data = {dim: self.labels[dim][i] for dim, i in zip(dimensions, index)}
+        data[value_name] = summed[tuple(index)]
+        return pd.DataFrame(data)
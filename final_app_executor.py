@@ -0,0 +1,140 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Bounded executor for the heavy computations of the tabs.
+#
+# Dragging a slider queues rerun after rerun. Instead of computing on the
+# script thread, a tab submits its computation under an owner, a
+# (session, view) pair, and waits for it. Each owner has at most one job
+# running and one waiting: a new submit replaces the waiting job of its
+# owner, so the filter states a slider passed over are dropped before they
+# start. At most `slots` jobs run at once over all sessions, and owners
+# waiting for a slot are served in the order they first asked, so one
+# session scrubbing a slider holds one slot per view and cannot starve the
+# others. A job cancelled while running (its rerun was interrupted) is
+# left to finish but its result is discarded.
+#
+# Threads rather than processes: the jobs are numpy and pandas work on the
+# shared in-memory data, which would otherwise have to be copied over.
+
+
+class Superseded(Exception):
+    pass
+
+
+class Job:
+
+    def __init__(self, request_id, compute):
+        self.request_id = request_id
+        self.compute = compute
+        self.done = threading.Event()
+        self.cancelled = False
+        self.value = None
+        self.error = None
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def result(self):
+        self.done.wait()
+        if self.cancelled:
+            raise Superseded(self.request_id)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class ComputeExecutor:
+
+    def __init__(self, slots=None):
+        self.slots = slots or min(4, os.cpu_count() or 1)
+        self.pool = ThreadPoolExecutor(max_workers=self.slots, thread_name_prefix='compute')
+        self.running = {}
+        self.waiting = OrderedDict()
+        self.next_id = 0
+        self.submitted = 0
+        self.superseded = 0
+        self.cancelled = 0
+        self.discarded = 0
+        self.completed = 0
+        self.lock = threading.Lock()
+
+    def submit(self, owner, compute):
+        with self.lock:
+            self.next_id += 1
+            self.submitted += 1
+            job = Job(self.next_id, compute)
+            replaced = self.waiting.get(owner)
+            if replaced is not None:
+                # Keeps the owner's place in the queue
+                self._drop(replaced)
+                self.superseded += 1
+            self.waiting[owner] = job
+            started = self._dispatch()
+        self._start(started)
+        return job
+
+    def cancel(self, owner, job):
+        # Drops a waiting job; a running one finishes but its result is
+        # discarded
+        with self.lock:
+            if job.done.is_set():
+                return
+            if self.waiting.get(owner) is job:
+                del self.waiting[owner]
+                self._drop(job)
+            else:
+                job.cancelled = True
+            self.cancelled += 1
+
+    def _drop(self, job):
+        job.cancelled = True
+        job.done.set()
+
+    def _dispatch(self):
+        # With the lock held: moves waiting jobs into free slots, skipping
+        # owners that already have one running
+        started = []
+        for owner in list(self.waiting):
+            if len(self.running) >= self.slots:
+                break
+            if owner not in self.running:
+                job = self.running[owner] = self.waiting.pop(owner)
+                started.append((owner, job))
+        return started
+
+    def _start(self, started):
+        for owner, job in started:
+            self.pool.submit(self._run, owner, job)
+
+    def _run(self, owner, job):
+        try:
+            job.value = job.compute()
+        except BaseException as e:
+            job.error = e
+        finally:
+            with self.lock:
+                del self.running[owner]
+                if job.cancelled:
+                    self.discarded += 1
+                    job.value = job.error = None
+                else:
+                    self.completed += 1
+                started = self._dispatch()
+            job.done.set()
+            self._start(started)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'slots': self.slots,
+                'running': len(self.running),
+                'waiting': len(self.waiting),
+                'submitted': self.submitted,
+                'superseded': self.superseded,
+                'cancelled': self.cancelled,
+                'discarded': self.discarded,
+                'completed': self.completed,
+            }
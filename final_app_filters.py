@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+# Sidebar filter engine shared by the Demographics, Tumor and Survival tabs.
+#
+# A FilterIndex is built once per dataset. For every indexed column it keeps
+# one packed bitmap (1 bit per row) per distinct value; for the year column
+# it keeps cumulative "year <= y" bitmaps so that any year range is the
+# difference of two of them. Answering a filter selection is then a handful
+# of OR/AND-NOT operations over N/8 bytes instead of comparisons and isin
+# scans over the full columns.
+
+YEAR_COLUMN = 'year_of_diagnosis'
+INDEXED_COLUMNS = [YEAR_COLUMN, 'age_group', 'tumor_site', 'adjusted_ajcc_6th_stage']
+
+
+class FilterIndex:
+
+    def __init__(self, df, columns=INDEXED_COLUMNS):
+        self.rows = len(df)
+        self.bitmaps = {}
+        self.years = None
+        self.years_upto = None
+        for col in columns:
+            if col not in df.columns:
+                continue
+            codes, uniques = pd.factorize(df[col], sort=True)
+            if col == YEAR_COLUMN:
+                self._index_years(codes, uniques)
+            else:
+                self.bitmaps[col] = {value: np.packbits(codes == i) for i, value in enumerate(uniques)}
+
+    def _index_years(self, codes, uniques):
+        self.years = np.asarray(uniques)
+        self.years_complete = not (codes < 0).any()
+        upto = np.zeros((len(uniques), (self.rows + 7) // 8), dtype=np.uint8)
+        running = np.zeros(upto.shape[1], dtype=np.uint8)
+        for i in range(len(uniques)):
+            running |= np.packbits(codes == i)
+            upto[i] = running
+        self.years_upto = upto
+
+    def _year_bitmap(self, year_range):
+        lo, hi = year_range
+        # Last indexed year <= hi and last indexed year < lo
+        hi_i = np.searchsorted(self.years, hi, side='right') - 1
+        lo_i = np.searchsorted(self.years, lo, side='left') - 1
+        if hi_i < 0 or hi_i <= lo_i:
+            return np.zeros(self.years_upto.shape[1], dtype=np.uint8)
+        if lo_i < 0:
+            return self.years_upto[hi_i]
+        return self.years_upto[hi_i] & ~self.years_upto[lo_i]
+
+    def _value_bitmap(self, col, values):
+        bitmaps = self.bitmaps[col]
+        result = np.zeros((self.rows + 7) // 8, dtype=np.uint8)
+        for value in values:
+            if value in bitmaps:
+                result |= bitmaps[value]
+        return result
+
+    def bitmap(self, filters):
+        # Packed bitmap of the matching rows, or None when nothing is filtered.
+        # filters maps a column to a (lo, hi) year range or a list of values;
+        # empty selections and columns the dataset does not have are ignored.
+        result = None
+        for col, selected in filters.items():
+            if col == YEAR_COLUMN and self.years is not None and selected is not None:
+                covers = selected[0] <= self.years[0] and selected[1] >= self.years[-1]
+                if covers and self.years_complete:
+                    continue
+                part = self._year_bitmap(selected)
+            elif col in self.bitmaps and selected:
+                part = self._value_bitmap(col, selected)
+            else:
+                continue
+            result = part if result is None else result & part
+        return result
+
+    def positions(self, filters):
+        result = self.bitmap(filters)
+        if result is None:
+            return None
+        return np.flatnonzero(np.unpackbits(result, count=self.rows))
+
+    def apply(self, df, filters):
+        positions = self.positions(filters)
+        if positions is None:
+            return df
+        return df.take(positions)
@@ -1,112 +1,282 @@
 from final_app_common import *
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
 import requests
 from io import StringIO
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import LabelEncoder, StandardScaler
 from scipy.stats import mode
+from final_app_cache import normalized_filters
+from final_app_clustering import clustering_features, encode_features, num_clusters
+from final_app_genome_data import CASE_KEYS, GENE_SETS
+from final_app_kernels import group_box, group_density, group_mode, group_rows, group_sum
+from final_app_views import ViewSet
 
 
-clustering_features = ['age_at_diagnosis', 'Cancer Stage Encoded', 'Site Encoded']
-num_clusters = 50
-exclude_diag = ["Not Reported", "Tubular adenocarcinoma", "Basal cell carcinoma, NOS", 
-                "Phyllodes tumor, malignant", "Large cell neuroendocrine carcinoma", "Pleomorphic carcinoma","Carcinoma, NOS"]
-exclude_n = ["Unknown","nan","N1c","N0 (mol+)","N3c"]
-exclude_m = ["Unknown","nan"]
-exclude_t = ["Unknown","nan","T4d","T2b","T3a","T2a"]
+# Most genes the gene selector lists at once
+max_gene_options = 500
 
 
+def cluster_heatmap(clusters, stages, sums, counts, genes):
+    # Cluster x gene mean expression from per-row (case or stratum) sums and
+    # counts, with the most frequent Cancer Stage of each cluster
+    cluster_codes, cluster_ids = pd.factorize(clusters, sort=True)
+    cluster_sums = group_sum(cluster_codes, sums, len(cluster_ids))
+    cluster_counts = group_sum(cluster_codes, counts, len(cluster_ids))
+    if not cluster_counts.any():
+        return pd.DataFrame(), []
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = cluster_sums / cluster_counts
+    keep_clusters = cluster_counts.sum(axis=1) > 0
+    keep_genes = cluster_counts.sum(axis=0) > 0
+    heatmap_data = pd.DataFrame(
+        means[keep_clusters][:, keep_genes],
+        index=pd.Index(cluster_ids[keep_clusters], name='Cluster'),
+        columns=pd.Index(genes[keep_genes], name='Gene'),
+    )
+    # Each measured value counts once towards its cluster's stage mode
+    stage_codes, stage_labels = pd.factorize(stages, sort=True)
+    stage = group_mode(cluster_codes, stage_codes, len(cluster_ids), len(stage_labels), weights=counts.sum(axis=1))
+    stage = stage[keep_clusters]
+    stage_labels = np.append(np.asarray(stage_labels, dtype=object), np.nan)
+    return heatmap_data, stage_labels[stage]
 
-def genome_dashboard():
-    tabs()
-    clusterdata = load_data('genome_cluster')
-    st.sidebar.title("Filters")
-    # Gene filter (no exclusion here)
-    unique_genes = sorted(clusterdata['Gene'].unique())
-    selected_genes = st.sidebar.multiselect("Select Genes:", options=unique_genes, default=[])
-    # Cancer Stage filter
-    unique_stages = sorted(clusterdata['Cancer Stage'].dropna().unique())
-    selected_stages = st.sidebar.multiselect("Select Cancer Stages:", options=unique_stages, default=[])
 
-    # Pathologic N filter
-    unique_n = sorted([x for x in clusterdata['ajcc_pathologic_n'].dropna().unique() if x not in exclude_n])
-    selected_n = st.sidebar.multiselect("Select Pathologic N Stages:", options=unique_n, default=[])
+def box_figure(df, col, axis_title, colors):
+    # Box per category drawn from its quartiles and whiskers, computed from
+    # the cases in `df`; only the values beyond the whiskers are sent to the
+    # browser as points
+    codes, names = pd.factorize(df[col])
+    values = df['Expression'].to_numpy(dtype=float)
+    stats = group_box(codes, values, len(names))
+    outlier_rows = group_rows(codes, len(names), stats['outliers'])
+    fig = go.Figure()
+    for i, name in enumerate(names):
+        color = colors[i % len(colors)]
+        fig.add_trace(go.Box(
+            x=[name], q1=[stats['q1'][i]], median=[stats['median'][i]], q3=[stats['q3'][i]],
+            lowerfence=[stats['lowerfence'][i]], upperfence=[stats['upperfence'][i]],
+            name=str(name), marker_color=color, boxpoints=False,
+        ))
+        outliers = values[outlier_rows[i]]
+        if len(outliers):
+            fig.add_trace(go.Scatter(x=[name] * len(outliers), y=outliers, mode='markers', marker_color=color,
+                                     name=str(name), showlegend=False))
+    fig.update_layout(xaxis_title=axis_title, yaxis_title='Expression Level')
+    return fig
 
-    # Pathologic M filter
-    unique_m = sorted([x for x in clusterdata['ajcc_pathologic_m'].dropna().unique() if x not in exclude_m])
-    selected_m = st.sidebar.multiselect("Select Pathologic M Stages:", options=unique_m, default=[])
 
-    # Pathologic T filter
-    unique_t = sorted([x for x in clusterdata['ajcc_pathologic_t'].dropna().unique() if x not in exclude_t])
-    selected_t = st.sidebar.multiselect("Select Pathologic T Stages:", options=unique_t, default=[])
+def violin_figure(df, col, axis_title, colors):
+    # Violin per category drawn as the outline of its kernel density on a
+    # shared grid, with the box of its quartiles inside
+    codes, names = pd.factorize(df[col])
+    values = df['Expression'].to_numpy(dtype=float)
+    grid, density = group_density(codes, values, len(names), points=128)
+    stats = group_box(codes, values, len(names))
+    half_width = 0.45 / np.nanmax(density) if np.isfinite(density).any() else 0.0
+    fig = go.Figure()
+    for i, name in enumerate(names):
+        color = colors[i % len(colors)]
+        span = np.isfinite(density[i])
+        width = density[i, span] * half_width
+        fig.add_trace(go.Scatter(
+            x=np.r_[i + width, (i - width)[::-1]].astype(np.float32),
+            y=np.r_[grid[span], grid[span][::-1]].astype(np.float32),
+            fill='toself', mode='lines', line=dict(color=color), name=str(name), hoverinfo='name',
+        ))
+        fig.add_trace(go.Box(
+            x=[i], q1=[stats['q1'][i]], median=[stats['median'][i]], q3=[stats['q3'][i]],
+            lowerfence=[stats['lowerfence'][i]], upperfence=[stats['upperfence'][i]],
+            name=str(name), marker_color=color, fillcolor='white', width=0.08, boxpoints=False, showlegend=False,
+        ))
+    fig.update_layout(
+        xaxis=dict(title=axis_title, tickmode='array', tickvals=list(range(len(names))), ticktext=list(names)),
+        yaxis_title='Expression Level',
+    )
+    return fig
 
-    # Primary Diagnosis filter
-    unique_diag = sorted([d for d in clusterdata['primary_diagnosis'].dropna().unique() if d not in exclude_diag])
-    selected_diag = st.sidebar.multiselect("Select Primary Diagnoses:", options=unique_diag, default=[])
 
-    # Expression slider using FULL range of clusterdata (default view)
-    min_expr, max_expr = float(clusterdata['Expression'].min()), float(clusterdata['Expression'].max())
-    expression_range = st.sidebar.slider(
-        "Select Expression Level Range:",
-        min_value=min_expr,
-        max_value=max_expr,
-        value=(min_expr, max_expr)
-    )
+def recluster(genome, rows, selections, k):
+    # (state, clusters) as from ClusterJobs.request: the cluster labels
+    # fitted on the filtered cases alone (None for cases with missing
+    # features) once the fit is 'done', otherwise None
+    positions, features = encode_features(genome.cases.iloc[rows])
+    if len(positions) < 2:
+        return 'failed', None
+    key = ('genome_cluster', dataset_version('genome_cluster'), normalized_filters(selections), k,
+           tuple(clustering_features))
+    state, labels = cluster_jobs().request(key, features, k)
+    if labels is None:
+        return state, None
+    clusters = np.full(len(rows), None, dtype=object)
+    clusters[positions] = labels
+    return state, clusters
 
-    # Apply filters to clusterdata
-    filtered_cluster = clusterdata.copy()
 
-    if selected_genes:
-        filtered_cluster = filtered_cluster[filtered_cluster['Gene'].isin(selected_genes)]
-    if selected_stages:
-        filtered_cluster = filtered_cluster[filtered_cluster['Cancer Stage'].isin(selected_stages)]
-    if selected_n:
-        filtered_cluster = filtered_cluster[filtered_cluster['ajcc_pathologic_n'].isin(selected_n)]
-    else:
-        # Always exclude the undesired N categories
-        filtered_cluster = filtered_cluster[~filtered_cluster['ajcc_pathologic_n'].isin(exclude_n)]
+def gene_columns(genome, genes):
+    # Matrix columns of the selected genes, all genes when none are selected
+    return np.sort(genome.gene_positions(genes)) if genes else np.arange(len(genome.genes))
 
-    if selected_m:
-        filtered_cluster = filtered_cluster[filtered_cluster['ajcc_pathologic_m'].isin(selected_m)]
-    else:
-        # Exclude unwanted M categories
-        filtered_cluster = filtered_cluster[~filtered_cluster['ajcc_pathologic_m'].isin(exclude_m)]
 
-    if selected_t:
-        filtered_cluster = filtered_cluster[filtered_cluster['ajcc_pathologic_t'].isin(selected_t)]
-    else:
-        # Exclude unwanted T categories
-        filtered_cluster = filtered_cluster[~filtered_cluster['ajcc_pathologic_t'].isin(exclude_t)]
+def case_values(genome, rows, columns, expression_range):
+    # Expression values of the selected cases and genes; values outside the
+    # expression range drop out as NaN
+    values = np.asarray(genome.values[rows][:, columns])
+    if tuple(expression_range) != genome.expression_range:
+        values = np.where((values >= expression_range[0]) & (values <= expression_range[1]), values, np.nan)
+    return values
 
-    if selected_diag:
-        filtered_cluster = filtered_cluster[filtered_cluster['primary_diagnosis'].isin(selected_diag)]
-    else:
-        # Exclude unwanted diagnoses
-        filtered_cluster = filtered_cluster[~filtered_cluster['primary_diagnosis'].isin(exclude_diag)]
-
-    filtered_cluster = filtered_cluster[
-        (filtered_cluster['Expression'] >= expression_range[0]) & (filtered_cluster['Expression'] <= expression_range[1])
-    ]
-
-    # Heatmap data
-    if not filtered_cluster.empty:
-        cluster_aggregated = filtered_cluster.groupby('Cluster').agg({'Cancer Stage': lambda x: x.mode()[0]}).reset_index()
-        heatmap_data = filtered_cluster.pivot_table(
-            index='Cluster',
-            columns='Gene',
-            values='Expression',
-            aggfunc='mean'
+
+# Charts of the page as views (see final_app_views). The page state they
+# read: 'selections' (case filters), 'expression_range', 'recluster_k' (k,
+# or None for the stored clusters), 'genes' (the selected genes, all genes
+# when empty) and 'cluster' (the heatmap cluster clicked, or None). Every
+# chart reads 'genes'; only the distribution charts read 'cluster'.
+views = ViewSet(max_bytes=64 * 2**20)
+report('genome views', views.cache.stats)
+genome_inputs = ['selections', 'expression_range', 'recluster_k']
+
+
+@views.view(inputs=genome_inputs + ['genes'], datasets=['genome_cluster'],
+            resources=['genome', 'rows', 'clusters', 'stats'])
+def heatmap(selections, expression_range, recluster_k, genes, genome, rows, clusters, stats):
+    # Straight from the per-stratum statistics (`stats`, passed only when
+    # they apply) unless the expression range cuts through individual values
+    # or the cases were re-clustered
+    columns = gene_columns(genome, genes)
+    if stats is not None:
+        strata = np.flatnonzero(stats.filters.mask(selections))
+        return cluster_heatmap(
+            stats.strata['Cluster'].to_numpy()[strata],
+            stats.strata['Cancer Stage'].to_numpy()[strata],
+            stats.sums[strata][:, columns],
+            stats.counts[strata][:, columns],
+            genome.genes[columns],
         )
-        if not heatmap_data.empty:
-            heatmap_customdata = cluster_aggregated.set_index('Cluster').loc[heatmap_data.index, 'Cancer Stage'].values
-        else:
-            heatmap_data = pd.DataFrame()
-            heatmap_customdata = []
+    values = case_values(genome, rows, columns, expression_range)
+    measured = ~np.isnan(values)
+    return cluster_heatmap(
+        genome.cases['Cluster'].to_numpy()[rows] if clusters is None else clusters,
+        genome.cases['Cancer Stage'].to_numpy()[rows],
+        np.where(measured, values, 0),
+        measured,
+        genome.genes[columns],
+    )
+
+
+@views.view(inputs=genome_inputs + ['genes'], datasets=['genome_cluster'],
+            resources=['genome', 'rows', 'clusters'])
+def genome_cases(selections, expression_range, recluster_k, genes, genome, rows, clusters):
+    # Each case's mean over its values of the selected genes in the
+    # expression range, with its cluster
+    values = case_values(genome, rows, gene_columns(genome, genes), expression_range)
+    measured = ~np.isnan(values)
+    case_counts = measured.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        case_means = np.where(measured, values, 0).sum(axis=1) / case_counts
+    aggregated_data = genome.cases.iloc[rows][CASE_KEYS].assign(
+        Expression=case_means,
+        Cluster=genome.cases['Cluster'].to_numpy()[rows] if clusters is None else clusters,
+    )
+    return aggregated_data[case_counts > 0].dropna(subset=CASE_KEYS).reset_index(drop=True)
+
+
+@views.view(inputs=['cluster'], views=['genome_cases'])
+def picked_cases(cluster, genome_cases):
+    if cluster is None:
+        return genome_cases
+    return genome_cases[genome_cases['Cluster'].astype(str) == str(cluster)].reset_index(drop=True)
+
+
+@views.view(views=['picked_cases'])
+def stage_chart(picked_cases):
+    filtered_stage_data = picked_cases[picked_cases['ajcc_pathologic_stage'] != "Unknown"]
+    if filtered_stage_data.empty:
+        return None
+    stage_counts = filtered_stage_data['Cancer Stage'].value_counts().sort_index()
+    stage_counts = stage_counts[stage_counts > 0]
+    plot_data = stage_counts.reset_index()
+    plot_data.columns = ['Cancer Stage', 'Number of Cases']
+    fig_bar = px.bar(
+        plot_data,
+        x='Cancer Stage',
+        y='Number of Cases',
+        text='Number of Cases',
+        title='',#'Distribution of Cases by AJCC Pathologic Stage',
+        labels={'Cancer Stage': 'AJCC Pathologic Stage', 'Number of Cases': 'Number of Cases'},
+    )
+    fig_bar.update_traces(textposition='outside', marker_color='lightblue', marker_line_color='black', marker_line_width=1)
+    fig_bar.update_layout(xaxis_tickangle=45)
+    return fig_bar
+
+
+def register_box(name, col, axis_title):
+    @views.view(views=['picked_cases'], name=name)
+    def box_chart(picked_cases):
+        if picked_cases.empty:
+            return None
+        fig_box = box_figure(picked_cases, col, axis_title, px.colors.qualitative.Pastel)
+        fig_box.update_layout(xaxis_tickangle=45, showlegend=False)
+        return fig_box
+
+
+register_box('n_box', 'ajcc_pathologic_n', 'AJCC Pathologic N Stage')
+register_box('m_box', 'ajcc_pathologic_m', 'AJCC Pathologic M Stage')
+register_box('t_box', 'ajcc_pathologic_t', 'AJCC Pathologic T Stage')
+
+
+@views.view(views=['picked_cases'])
+def diagnosis_violin(picked_cases):
+    if picked_cases.empty:
+        return None
+    filtered_diag = picked_cases.copy()
+    filtered_diag['primary_diagnosis'] = filtered_diag['primary_diagnosis'].apply(
+        lambda x: '<br>'.join(x.split(' ', 3)[:3]) if len(x.split(' ')) > 3 else x.replace(' ', '<br>')
+    )
+    fig_violin = violin_figure(filtered_diag, 'primary_diagnosis', 'Primary Diagnosis',
+                               px.colors.qualitative.Set2)
+    fig_violin.update_layout(xaxis_tickangle=0, showlegend=False, width=1200, height=700)
+    return fig_violin
+
+
+distribution_charts = ['stage_chart', 'n_box', 'm_box', 't_box', 'diagnosis_violin']
+
+
+def show_chart(fig):
+    if fig is None:
+        st.write("No data available for the selected filters.")
     else:
-        heatmap_data = pd.DataFrame()
-        heatmap_customdata = []
+        st.plotly_chart(fig, use_container_width=True)
+
+
+# The gene selector and a click on the heatmap rerun only this fragment,
+# which draws every chart of the page; the case filters come from the last
+# full run. The gene widgets go into `gene_box`, a container at the top of
+# the sidebar.
+@st.fragment
+def genome_charts(genome, gene_box, view_state, rows, clusters):
+    # Gene filter (no exclusion here): the selector only lists the genes
+    # matching the search, plus the ones already selected
+    gene_set = gene_box.selectbox("Gene Set:", ['All genes'] + list(GENE_SETS))
+    gene_search = gene_box.text_input("Search Genes:", "")
+    matching_genes = genome.gene_index.search(gene_search, None if gene_set == 'All genes' else gene_set)
+    kept_genes = st.session_state.get('genome_genes', [])
+    kept = set(kept_genes)
+    unique_genes = kept_genes + [g for g in matching_genes[:max_gene_options] if g not in kept]
+    selected_genes = gene_box.multiselect("Select Genes:", options=unique_genes, key='genome_genes')
+    if len(matching_genes) > max_gene_options:
+        gene_box.caption(f"Showing {max_gene_options} of {len(matching_genes):,} matching genes; "
+                         "type to narrow the search.")
+
+    # The shared structures are looked up here, on the script thread
+    view_state = dict(view_state, genes=selected_genes)
+    full_range = view_state['expression_range'] == genome.expression_range
+    stats = load_genome_stats() if full_range and clusters is None else None
+    heatmap_data, heatmap_customdata = run_compute('genome_heatmap', lambda: views.get(
+        'heatmap', view_state, genome=genome, rows=rows, clusters=clusters, stats=stats))
 
     st.markdown("### Heatmap of Mean Gene Expression Levels")
     if not heatmap_data.empty:
@@ -128,41 +298,34 @@ def genome_dashboard():
             customdata=heatmap_customdata
         )
         fig_heatmap.update_layout(width=1200, height=600)
-        st.plotly_chart(fig_heatmap, use_container_width=True)
+        event = st.plotly_chart(fig_heatmap, use_container_width=True, on_select='rerun',
+                                selection_mode='points',
+                                key=f"genome_heatmap_{st.session_state.get('genome_heatmap_round', 0)}")
+        points = event['selection']['points'] if event else []
+        picked = points[0]['y'] if points else None
+        if picked is not None and str(picked) not in set(heatmap_data.index.astype(str)):
+            picked = None
     else:
         st.write("No data available for the selected filters to display a heatmap.")
+        picked = None
 
-    # Aggregate for other plots
-    if not filtered_cluster.empty:
-        aggregated_data = filtered_cluster.groupby(
-            ['Case', 'Cancer Stage', 'ajcc_pathologic_n', 'ajcc_pathologic_m', 'ajcc_pathologic_t', 'ajcc_pathologic_stage', 'primary_diagnosis'],
-            as_index=False
-        ).agg({'Expression': 'mean'})
-    else:
-        aggregated_data = pd.DataFrame()
+    # Distribution charts: each case's mean over the selected genes in the
+    # expression range, narrowed to the cluster picked in the heatmap. Views
+    # whose inputs did not change come straight from the cache.
+    view_state['cluster'] = picked
+    charts = run_compute('genome', lambda: {
+        name: views.get(name, view_state, genome=genome, rows=rows, clusters=clusters)
+        for name in distribution_charts
+    })
+    if picked is not None:
+        st.info(f"Showing the cases of cluster {picked}, picked in the heatmap.")
+        if st.button("Show all clusters"):
+            # A new chart key drops the heatmap's selection
+            st.session_state.genome_heatmap_round = st.session_state.get('genome_heatmap_round', 0) + 1
+            st.rerun()
 
     st.markdown("### Distribution of Cases by AJCC Pathologic Stage")
-    if not aggregated_data.empty and 'ajcc_pathologic_stage' in aggregated_data.columns:
-        filtered_stage_data = aggregated_data[aggregated_data['ajcc_pathologic_stage'] != "Unknown"]
-        if not filtered_stage_data.empty:
-            stage_counts = filtered_stage_data['Cancer Stage'].value_counts().sort_index()
-            plot_data = stage_counts.reset_index()
-            plot_data.columns = ['Cancer Stage', 'Number of Cases']
-            fig_bar = px.bar(
-                plot_data,
-                x='Cancer Stage',
-                y='Number of Cases',
-                text='Number of Cases',
-                title='',#'Distribution of Cases by AJCC Pathologic Stage',
-                labels={'Cancer Stage': 'AJCC Pathologic Stage', 'Number of Cases': 'Number of Cases'},
-            )
-            fig_bar.update_traces(textposition='outside', marker_color='lightblue', marker_line_color='black', marker_line_width=1)
-            fig_bar.update_layout(xaxis_tickangle=45)
-            st.plotly_chart(fig_bar, use_container_width=True)
-        else:
-            st.write("No data available for the selected filters.")
-    else:
-        st.write("No data available for the selected filters.")
+    show_chart(charts['stage_chart'])
 
     st.markdown(
         """
@@ -177,23 +340,7 @@ def genome_dashboard():
         """,
         unsafe_allow_html=True
     )
-    if not aggregated_data.empty and 'ajcc_pathologic_n' in aggregated_data.columns:
-        if not aggregated_data.empty:
-            fig_box_n = px.box(
-                aggregated_data,
-                x='ajcc_pathologic_n',
-                y='Expression',
-                color='ajcc_pathologic_n',
-                title='',#"Average Gene Expression Across Selected Pathologic N Stages",
-                labels={'ajcc_pathologic_n': 'AJCC Pathologic N Stage', 'Expression': 'Expression Level'},
-                color_discrete_sequence=px.colors.qualitative.Pastel
-            )
-            fig_box_n.update_layout(xaxis_tickangle=45, showlegend=False)
-            st.plotly_chart(fig_box_n, use_container_width=True)
-        else:
-            st.write("No data available for the selected filters.")
-    else:
-        st.write("No data available for the selected filters.")
+    show_chart(charts['n_box'])
 
     st.markdown(
     """
@@ -208,20 +355,7 @@ def genome_dashboard():
     """,
     unsafe_allow_html=True
     )
-    if not aggregated_data.empty and 'ajcc_pathologic_m' in aggregated_data.columns:
-        fig_box_m = px.box(
-            aggregated_data,
-            x='ajcc_pathologic_m',
-            y='Expression',
-            color='ajcc_pathologic_m',
-            title='',#"Average Gene Expression Across Selected Pathologic M Stages",
-            labels={'ajcc_pathologic_m': 'AJCC Pathologic M Stage', 'Expression': 'Expression Level'},
-            color_discrete_sequence=px.colors.qualitative.Pastel
-        )
-        fig_box_m.update_layout(xaxis_tickangle=45, showlegend=False)
-        st.plotly_chart(fig_box_m, use_container_width=True)
-    else:
-        st.write("No data available for the selected filters.")
+    show_chart(charts['m_box'])
 
     st.markdown(
         """
@@ -269,42 +403,80 @@ def genome_dashboard():
         """,
     unsafe_allow_html=True
     )
-    if not aggregated_data.empty and 'ajcc_pathologic_t' in aggregated_data.columns:
-        fig_box_t = px.box(
-            aggregated_data,
-            x='ajcc_pathologic_t',
-            y='Expression',
-            color='ajcc_pathologic_t',
-            title='',#"Average Gene Expression Across Selected Pathologic T Stages",
-            labels={'ajcc_pathologic_t': 'AJCC Pathologic T Stage', 'Expression': 'Expression Level'},
-            color_discrete_sequence=px.colors.qualitative.Pastel
-        )
-        fig_box_t.update_layout(xaxis_tickangle=45, showlegend=False)
-        st.plotly_chart(fig_box_t, use_container_width=True)
-    else:
-        st.write("No data available for the selected filters.")
+    show_chart(charts['t_box'])
 
     st.markdown("### Gene Expression Distribution Across Primary Diagnosis")
-    if not aggregated_data.empty and 'primary_diagnosis' in aggregated_data.columns:
-        filtered_diag = aggregated_data.copy()
-        if not filtered_diag.empty:
-            filtered_diag['primary_diagnosis'] = filtered_diag['primary_diagnosis'].apply(
-                lambda x: '<br>'.join(x.split(' ', 3)[:3]) if len(x.split(' ')) > 3 else x.replace(' ', '<br>')
-            )
-            fig_violin = px.violin(
-                filtered_diag,
-                x='primary_diagnosis',
-                y='Expression',
-                box=True,
-                points=False,
-                color='primary_diagnosis',
-                title='',#"Gene Expression Distribution Across Selected Primary Diagnoses",
-                labels={'primary_diagnosis': 'Primary Diagnosis', 'Expression': 'Expression Level'},
-                color_discrete_sequence=px.colors.qualitative.Set2
-            )
-            fig_violin.update_layout(xaxis_tickangle=0, showlegend=False, width=1200, height=700)
-            st.plotly_chart(fig_violin, use_container_width=True)
-        else:
-            st.write("No data available for the selected filters.")
-    else:
-        st.write("No data available for the selected filters.")
+    show_chart(charts['diagnosis_violin'])
+
+
+def genome_dashboard():
+    tabs()
+    genome = load_genome()
+    options = genome.filters.options
+    st.sidebar.title("Filters")
+    # Filled by the heatmap fragment
+    gene_box = st.sidebar.container()
+
+    # Cancer Stage filter
+    unique_stages = options('Cancer Stage')
+    selected_stages = st.sidebar.multiselect("Select Cancer Stages:", options=unique_stages, default=[])
+
+    # Pathologic N filter
+    unique_n = options('ajcc_pathologic_n')
+    selected_n = st.sidebar.multiselect("Select Pathologic N Stages:", options=unique_n, default=[])
+
+    # Pathologic M filter
+    unique_m = options('ajcc_pathologic_m')
+    selected_m = st.sidebar.multiselect("Select Pathologic M Stages:", options=unique_m, default=[])
+
+    # Pathologic T filter
+    unique_t = options('ajcc_pathologic_t')
+    selected_t = st.sidebar.multiselect("Select Pathologic T Stages:", options=unique_t, default=[])
+
+    # Primary Diagnosis filter
+    unique_diag = options('primary_diagnosis')
+    selected_diag = st.sidebar.multiselect("Select Primary Diagnoses:", options=unique_diag, default=[])
+
+    # Expression slider using FULL range of the data (default view)
+    min_expr, max_expr = genome.expression_range
+    expression_range = st.sidebar.slider(
+        "Select Expression Level Range:",
+        min_value=min_expr,
+        max_value=max_expr,
+        value=(min_expr, max_expr)
+    )
+
+    # Optional clusters of the filtered cases only
+    reclustering = st.sidebar.checkbox("Re-cluster filtered cases", value=False)
+    k = st.sidebar.slider("Number of clusters:", min_value=2, max_value=num_clusters, value=num_clusters,
+                          disabled=not reclustering)
+
+    # Apply the case filters
+    selections = {
+        'Cancer Stage': selected_stages,
+        'ajcc_pathologic_n': selected_n,
+        'ajcc_pathologic_m': selected_m,
+        'ajcc_pathologic_t': selected_t,
+        'primary_diagnosis': selected_diag,
+    }
+    case_mask = genome.filters.mask(selections)
+    rows = np.flatnonzero(case_mask)
+
+    clusters = None
+    if reclustering:
+        state, clusters = recluster(genome, rows, selections, k)
+        if state == 'running':
+            st.info(f"Re-clustering {len(rows)} cases into {k} clusters in the background; "
+                    "the stored clusters are shown until it finishes.")
+            st.button("Refresh")
+        elif state == 'busy':
+            st.warning("The clustering workers are busy; the stored clusters are shown. Try again shortly.")
+        elif state == 'failed':
+            st.warning("The filtered cases could not be re-clustered; the stored clusters are shown.")
+
+    view_state = {
+        'selections': selections,
+        'expression_range': tuple(float(x) for x in expression_range),
+        'recluster_k': None if clusters is None else k,
+    }
+    genome_charts(genome, gene_box, view_state, rows, clusters)
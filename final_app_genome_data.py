@@ -0,0 +1,260 @@
+import json
+import os
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from final_app_kernels import group_codes, group_sum
+from final_app_storage import (
+    SOURCE_EXT, columnar_path, csv_path, dataset_version, read_dataset, read_record, write_dataset, write_record,
+)
+
+# Dense layout of the genome expression data.
+#
+# The long table keeps one row per (Case, Gene) and repeats every case
+# attribute on each of them. GenomeMatrix keeps the expression values as a
+# float32 case x gene matrix (NaN where a gene was not measured) next to a
+# table with one row of attributes per case, in the same order. Selecting
+# genes is then column slicing and a case-level aggregate is a row mean.
+#
+# The matrix is derived from the long dataset on first use and written next
+# to it ('<name>.matrix.npy', '<name>.genes.json' and the '<name> cases'
+# dataset); it is rebuilt whenever the long dataset is newer.
+
+# Categories each Genome filter leaves out when nothing is selected in it
+exclude_diag = ["Not Reported", "Tubular adenocarcinoma", "Basal cell carcinoma, NOS",
+                "Phyllodes tumor, malignant", "Large cell neuroendocrine carcinoma", "Pleomorphic carcinoma","Carcinoma, NOS"]
+exclude_n = ["Unknown","nan","N1c","N0 (mol+)","N3c"]
+exclude_m = ["Unknown","nan"]
+exclude_t = ["Unknown","nan","T4d","T2b","T3a","T2a"]
+GENOME_EXCLUSIONS = {
+    'ajcc_pathologic_n': exclude_n,
+    'ajcc_pathologic_m': exclude_m,
+    'ajcc_pathologic_t': exclude_t,
+    'primary_diagnosis': exclude_diag,
+}
+
+# Named gene sets offered by the gene selector
+PAM50_GENES = ['ACTR3B', 'ANLN', 'BAG1', 'BCL2', 'BIRC5', 'BLVRA', 'CCNB1', 'CCNE1', 'CDC20', 'CDC6',
+               'CDH3', 'CENPF', 'CEP55', 'CXXC5', 'EGFR', 'ERBB2', 'ESR1', 'EXO1', 'FGFR4', 'FOXA1',
+               'FOXC1', 'GPR160', 'GRB7', 'KIF2C', 'KRT14', 'KRT17', 'KRT5', 'MAPT', 'MDM2', 'MELK',
+               'MIA', 'MKI67', 'MLPH', 'MMP11', 'MYBL2', 'MYC', 'NAT1', 'NDC80', 'NUF2', 'ORC6',
+               'PGR', 'PHGDH', 'PTTG1', 'RRM2', 'SFRP1', 'SLC39A6', 'TMEM45B', 'TYMS', 'UBE2C', 'UBE2T']
+GENE_SETS = {'PAM50': PAM50_GENES}
+
+# Case attributes the Genome sidebar filters on
+FILTER_KEYS = ['Cancer Stage', 'ajcc_pathologic_n', 'ajcc_pathologic_m', 'ajcc_pathologic_t', 'primary_diagnosis']
+
+# Attributes the Genome charts group cases by
+CASE_KEYS = ['Case', 'Cancer Stage', 'ajcc_pathologic_n', 'ajcc_pathologic_m', 'ajcc_pathologic_t',
+             'ajcc_pathologic_stage', 'primary_diagnosis']
+
+
+class GenomeMatrix:
+
+    def __init__(self, cases, genes, values):
+        self.cases = cases
+        self.genes = np.asarray(genes, dtype=object)
+        self.values = values
+        self.gene_position = {g: i for i, g in enumerate(self.genes)}
+        self.expression_range = (float(np.nanmin(values)), float(np.nanmax(values))) if values.size else (0.0, 0.0)
+        self.filters = CodedFilters(cases)
+        self.gene_index = GeneIndex(self.genes)
+
+    @classmethod
+    def from_long(cls, df):
+        df = df[df['Case'].notna() & df['Gene'].notna()]
+        case_codes, case_names = pd.factorize(df['Case'], sort=True)
+        gene_codes, genes = pd.factorize(df['Gene'], sort=True)
+        shape = (len(case_names), len(genes))
+        flat = case_codes * shape[1] + gene_codes
+        expression = df['Expression'].to_numpy(dtype=float)
+        measured = ~np.isnan(expression)
+        # Repeated (case, gene) rows are averaged, as the pivot did
+        sums = np.bincount(flat[measured], weights=expression[measured], minlength=shape[0] * shape[1])
+        counts = np.bincount(flat[measured], minlength=shape[0] * shape[1])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = (sums / counts).astype(np.float32).reshape(shape)
+        first_row = np.unique(case_codes, return_index=True)[1]
+        cases = df.iloc[first_row].drop(columns=['Gene', 'Expression']).reset_index(drop=True)
+        return cls(cases, np.asarray(genes), values)
+
+    def gene_positions(self, genes):
+        return np.array([self.gene_position[g] for g in genes if g in self.gene_position], dtype=np.intp)
+
+
+class GeneIndex:
+    # Case-insensitive gene name search. Names are kept sorted by their upper
+    # case form: a prefix is a bisect range, and a substring match is one
+    # vectorized find over all names.
+
+    def __init__(self, genes):
+        pairs = sorted((str(g).upper(), str(g)) for g in genes)
+        self.keys = [k for k, _ in pairs]
+        self.names = [g for _, g in pairs]
+        self.key_array = np.array(self.keys, dtype=str)
+        self.position = {g: i for i, g in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def prefix(self, text):
+        text = text.strip().upper()
+        return self.names[bisect_left(self.keys, text):bisect_left(self.keys, text + '\uffff')]
+
+    def gene_set(self, name):
+        # Genes of a named set that the data has, in name order
+        return sorted((g for g in GENE_SETS[name] if g in self.position), key=self.position.get)
+
+    def search(self, text='', gene_set=None, limit=None):
+        # Names starting with `text` first, then the others containing it,
+        # optionally within a gene set
+        text = text.strip().upper()
+        if gene_set is not None:
+            candidates = self.gene_set(gene_set)
+            matches = [g for g in candidates if g.upper().startswith(text)]
+            matches += [g for g in candidates if text in g.upper() and not g.upper().startswith(text)]
+        elif not text:
+            matches = self.names
+        else:
+            starts = self.prefix(text)
+            contains = np.flatnonzero(np.char.find(self.key_array, text) > 0)
+            matches = starts + [self.names[i] for i in contains]
+        return matches[:limit] if limit is not None else matches
+
+
+class CodedFilters:
+    # Genome sidebar filters over integer category codes. Each filter column
+    # is factorized once; a selection becomes a boolean lookup table over the
+    # column's categories, gathered by code, and the masks of all columns are
+    # combined in place. Rows missing a label have code -1, which picks the
+    # extra last entry of every lookup table. The mask of the default
+    # exclusions is computed up front, as most reruns leave some filter empty.
+
+    def __init__(self, df, columns=FILTER_KEYS, exclusions=GENOME_EXCLUSIONS):
+        self.codes, self.categories, self.keep = {}, {}, {}
+        self.option_lists = {}
+        for col in columns:
+            codes, categories = pd.factorize(df[col], sort=True)
+            self.codes[col] = codes
+            self.categories[col] = pd.Index(np.asarray(categories))
+            excluded = set(exclusions.get(col, ()))
+            self.option_lists[col] = sorted(x for x in self.categories[col] if x not in excluded)
+            if col in exclusions:
+                # Missing labels are never in an exclusion list
+                lookup = np.append(~self.categories[col].isin(exclusions[col]), True)
+                self.keep[col] = lookup[codes]
+        self.size = len(df)
+        self.default = np.logical_and.reduce(list(self.keep.values())) if self.keep else np.ones(self.size, dtype=bool)
+
+    def options(self, col):
+        # Sorted labels of a column as offered in its selector, without the
+        # excluded categories
+        return self.option_lists[col]
+
+    def mask(self, selections):
+        # Rows matching the selected labels of every column; a column with
+        # nothing selected only drops its excluded categories
+        chosen = {col: selected for col, selected in selections.items() if selected}
+        if not chosen:
+            return self.default
+        mask = np.ones(self.size, dtype=bool)
+        for col in self.codes:
+            if col in chosen:
+                lookup = np.append(self.categories[col].isin(chosen[col]), False)
+                mask &= lookup[self.codes[col]]
+            elif col in self.keep:
+                mask &= self.keep[col]
+        return mask
+
+
+def matrix_path(name):
+    return name + '.matrix.npy'
+
+
+def genes_path(name):
+    return name + '.genes.json'
+
+
+def cases_name(name):
+    return name + ' cases'
+
+
+def matrix_source_path(name):
+    return matrix_path(name) + SOURCE_EXT
+
+
+def matrix_is_current(name):
+    # Current when written from the version of the long table there is now
+    files = [matrix_path(name), genes_path(name), columnar_path(cases_name(name))]
+    if not all(os.path.exists(f) for f in files):
+        return False
+    if not (os.path.exists(csv_path(name)) or os.path.exists(columnar_path(name))):
+        return True
+    record = read_record(matrix_source_path(name)) or {}
+    return record.get('version') == dataset_version(name)
+
+
+def write_matrix(name, genome, version):
+    write_dataset(cases_name(name), genome.cases)
+    with open(genes_path(name), 'w') as f:
+        json.dump([str(g) for g in genome.genes], f)
+    tmp = matrix_path(name) + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, genome.values)
+    os.replace(tmp, matrix_path(name))
+    write_record(matrix_source_path(name), {'version': version})
+
+
+def read_matrix(name='genome_cluster'):
+    if matrix_is_current(name):
+        with open(genes_path(name)) as f:
+            genes = json.load(f)
+        # Memory-mapped: values are paged in from the file as they are read
+        # rather than loaded up front
+        values = np.load(matrix_path(name), mmap_mode='r')
+        return GenomeMatrix(read_dataset(cases_name(name)), genes, values)
+    version = dataset_version(name)
+    genome = GenomeMatrix.from_long(read_dataset(name))
+    try:
+        write_matrix(name, genome, version)
+    except OSError:
+        pass
+    return genome
+
+
+# The Genome filter columns plus the heatmap rows
+STRATUM_KEYS = ['Cluster'] + FILTER_KEYS
+
+
+class ClusterGeneStats:
+    # Sufficient statistics for the heatmap: per-gene sums (float32) and
+    # counts (the narrowest unsigned type that holds them) of the measured
+    # values for every stratum, i.e. every distinct combination of
+    # STRATUM_KEYS among the cases. Any sidebar selection keeps whole strata,
+    # so a filtered cluster x gene mean is a masked sum over these arrays
+    # divided by the matching masked count. They only pay off when there are
+    # far fewer strata than cases: build() returns None when there are more
+    # than `max_share` strata per case, and the heatmap then works on the
+    # case matrix.
+
+    def __init__(self, genome, codes, first):
+        keys = genome.cases[STRATUM_KEYS]
+        self.strata = keys.iloc[first].reset_index(drop=True)
+        values = np.asarray(genome.values)
+        measured = ~np.isnan(values)
+        self.sums = group_sum(codes, np.where(measured, values, 0), len(first)).astype(np.float32)
+        counts = group_sum(codes, measured, len(first))
+        self.counts = counts.astype(np.min_scalar_type(int(counts.max()) if counts.size else 0))
+        self.filters = CodedFilters(self.strata)
+
+    @classmethod
+    def build(cls, genome, max_share=0.25):
+        keys = genome.cases[STRATUM_KEYS]
+        # Missing labels form their own stratum level, as the filters treat
+        # them as a value of their own
+        codes, first = group_codes(*(keys[k] for k in STRATUM_KEYS), dropna=False)
+        if len(first) > max_share * len(genome.cases):
+            return None
+        return cls(genome, codes, first)
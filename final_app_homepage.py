@@ -2,7 +2,9 @@ import streamlit as st
 from streamlit_lottie import st_lottie
 import json
 
+@st.cache_resource
 def load_lottie_file(filepath):
+    # Parsed once per process and shared by every session
     with open(filepath, "r") as f:
         return json.load(f)
 
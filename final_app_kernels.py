@@ -0,0 +1,192 @@
+import numpy as np
+import pandas as pd
+
+# Grouped aggregation kernels over integer group codes.
+#
+# Every kernel takes `codes`, the group of each row as an integer in
+# [0, size), with -1 for rows that belong to no group. Counts, sums, means
+# and modes are single bincount passes over the rows: the cost is linear in
+# the number of rows and there is no per-group Python work, unlike a
+# groupby with a lambda. group_codes() turns one or more key columns into
+# such codes, numbering the groups in sorted key order as groupby does.
+
+
+def group_codes(*columns, dropna=True):
+    # Group code of each row's combination of key values and the position of
+    # the first row of every group. Rows missing a key get -1 unless
+    # `dropna` is False, in which case missing values form a group of their own.
+    factorized = [pd.factorize(c, sort=True, use_na_sentinel=dropna) for c in columns]
+    codes = [np.asarray(c) for c, _ in factorized]
+    shape = tuple(max(len(u), 1) for _, u in factorized)
+    size = len(codes[0]) if codes else 0
+    keep = np.logical_and.reduce([c >= 0 for c in codes]) if codes else np.ones(size, dtype=bool)
+    if not codes:
+        flat = np.zeros(keep.sum(), dtype=np.intp)
+    elif np.prod(shape, dtype=float) < 2 ** 62:
+        flat = np.ravel_multi_index([c[keep] for c in codes], shape)
+    else:
+        # Too many combinations for one integer: unique rows of the codes
+        flat = np.column_stack([c[keep] for c in codes])
+    _, first, inverse = np.unique(flat, axis=0, return_index=True, return_inverse=True)
+    group = np.full(size, -1, dtype=np.intp)
+    group[keep] = inverse.ravel()
+    return group, np.flatnonzero(keep)[first]
+
+
+def group_count(codes, size, weights=None):
+    codes = np.asarray(codes)
+    keep = codes >= 0
+    weights = None if weights is None else np.asarray(weights, dtype=float)[keep]
+    return np.bincount(codes[keep], weights=weights, minlength=size)
+
+
+def group_sum(codes, values, size, block_bytes=2**25):
+    # Sums of `values` (rows x columns, or one value per row) per group;
+    # values must not be NaN. Rows are summed with np.add.reduceat over the
+    # rows sorted by group, a block of columns at a time, so the only
+    # temporaries are one block of rows and the size x columns result.
+    codes, values = np.asarray(codes), np.asarray(values)
+    keep = codes >= 0
+    if values.ndim == 1:
+        return np.bincount(codes[keep], weights=values[keep], minlength=size)
+    width = values.shape[1]
+    sums = np.zeros((size, width))
+    rows = np.flatnonzero(keep)
+    if not len(rows) or not width:
+        return sums
+    rows = rows[np.argsort(codes[rows], kind='stable')]
+    sorted_codes = codes[rows]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    groups = sorted_codes[starts]
+    step = max(1, block_bytes // (8 * len(rows)))
+    for first in range(0, width, step):
+        block = values[rows, first:first + step].astype(float)
+        sums[groups, first:first + step] = np.add.reduceat(block, starts, axis=0)
+    return sums
+
+
+def group_mean(codes, values, size):
+    # Means per group that skip NaN values; NaN where a group has none
+    values = np.asarray(values, dtype=float)
+    measured = ~np.isnan(values)
+    sums = group_sum(codes, np.where(measured, values, 0), size)
+    counts = group_sum(codes, measured, size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def group_mode(codes, labels, size, n_labels, weights=None):
+    # Most frequent label code per group, optionally weighted. Ties go to the
+    # smallest code, which for sorted codes matches Series.mode()[0]; groups
+    # without labelled rows get -1.
+    codes, labels = np.asarray(codes), np.asarray(labels)
+    keep = (codes >= 0) & (labels >= 0)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)[keep]
+    table = np.bincount(codes[keep] * n_labels + labels[keep], weights=weights,
+                        minlength=size * n_labels).reshape(size, n_labels)
+    if not n_labels:
+        return np.full(size, -1, dtype=np.intp)
+    return np.where(table.max(axis=1) > 0, table.argmax(axis=1), -1)
+
+
+def group_rows(codes, size, mask=None):
+    # Row positions of each group (optionally only the rows in `mask`), in
+    # row order, from one stable sort instead of a scan per group
+    codes = np.asarray(codes)
+    keep = codes >= 0 if mask is None else (codes >= 0) & mask
+    rows = np.flatnonzero(keep)
+    rows = rows[np.argsort(codes[rows], kind='stable')]
+    return np.split(rows, np.cumsum(np.bincount(codes[rows], minlength=size))[:-1])
+
+
+def group_quantiles(codes, values, size, qs):
+    # Exact quantiles per group (linear interpolation, as numpy and Plotly
+    # use), size x len(qs); NaN values are skipped and empty groups give NaN.
+    # One sort by (group, value) serves every group and every quantile.
+    codes, values = np.asarray(codes), np.asarray(values, dtype=float)
+    keep = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[keep], values[keep]
+    values = values[np.lexsort((values, codes))]
+    counts = np.bincount(codes, minlength=size)
+    starts = np.cumsum(counts) - counts
+    position = np.maximum(counts - 1, 0)[:, None] * np.asarray(qs, dtype=float)[None, :]
+    below = np.floor(position).astype(np.intp)
+    above = np.ceil(position).astype(np.intp)
+    if not len(values):
+        return np.full(position.shape, np.nan)
+    last = len(values) - 1
+    low = values[np.minimum(starts[:, None] + below, last)]
+    high = values[np.minimum(starts[:, None] + above, last)]
+    quantiles = low + (high - low) * (position - below)
+    quantiles[counts == 0] = np.nan
+    return quantiles
+
+
+def group_box(codes, values, size, whisker=1.5):
+    # Box plot statistics per group, exact over the rows given: quartiles,
+    # whiskers at the furthest values within `whisker` IQRs of the box, and
+    # a row mask of the values beyond the whiskers
+    codes, values = np.asarray(codes), np.asarray(values, dtype=float)
+    q1, median, q3 = group_quantiles(codes, values, size, [0.25, 0.5, 0.75]).T
+    keep = (codes >= 0) & ~np.isnan(values)
+    reach = whisker * (q3 - q1)
+    group = np.where(keep, codes, 0)
+    inside = keep & (values >= (q1 - reach)[group]) & (values <= (q3 + reach)[group])
+    lowerfence = np.full(size, np.inf)
+    upperfence = np.full(size, -np.inf)
+    np.minimum.at(lowerfence, codes[inside], values[inside])
+    np.maximum.at(upperfence, codes[inside], values[inside])
+    empty = ~np.isfinite(lowerfence)
+    lowerfence[empty], upperfence[empty] = np.nan, np.nan
+    return {'q1': q1, 'median': median, 'q3': q3, 'lowerfence': lowerfence, 'upperfence': upperfence,
+            'outliers': keep & ~inside}
+
+
+def group_histogram(codes, values, size, edges):
+    # Counts per group and bin on shared bin edges; histograms of disjoint
+    # sets of rows on the same edges add up
+    codes, values = np.asarray(codes), np.asarray(values, dtype=float)
+    keep = (codes >= 0) & (values >= edges[0]) & (values <= edges[-1])
+    bins = len(edges) - 1
+    which = np.clip(np.searchsorted(edges, values[keep], side='right') - 1, 0, bins - 1)
+    return group_count(codes[keep] * bins + which, size * bins).reshape(size, bins)
+
+
+def group_density(codes, values, size, points=512):
+    # Gaussian kernel density per group on one shared grid, from the group
+    # histograms on that grid (a binned KDE). Bandwidths follow Silverman's
+    # rule as Plotly's violins do, and each density is cut to the group's
+    # range plus two bandwidths. Returns the grid and a size x points array
+    # that is NaN outside each group's span.
+    codes, values = np.asarray(codes), np.asarray(values, dtype=float)
+    keep = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[keep], values[keep]
+    counts = np.bincount(codes, minlength=size)
+    q1, q3 = group_quantiles(codes, values, size, [0.25, 0.75]).T
+    means = group_sum(codes, values, size) / np.maximum(counts, 1)
+    spread = np.sqrt(np.maximum(group_sum(codes, values ** 2, size) / np.maximum(counts, 1) - means ** 2, 0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bandwidth = 1.059 * np.fmin(spread, (q3 - q1) / 1.349) * counts ** -0.2
+    bandwidth = np.where(bandwidth > 0, bandwidth, 1e-3)
+    lowest = np.full(size, np.inf)
+    highest = np.full(size, -np.inf)
+    np.minimum.at(lowest, codes, values)
+    np.maximum.at(highest, codes, values)
+    lo, hi = (lowest - 2 * bandwidth), (highest + 2 * bandwidth)
+    present = counts > 0
+    if not present.any():
+        return np.zeros(points), np.full((size, points), np.nan)
+    grid = np.linspace(lo[present].min(), hi[present].max(), points)
+    step = grid[1] - grid[0] if points > 1 else 1.0
+    edges = np.r_[grid - step / 2, grid[-1] + step / 2]
+    histogram = group_histogram(codes, values, size, edges)
+    density = np.full((size, points), np.nan)
+    for g in np.flatnonzero(present):
+        radius = int(np.ceil(4 * bandwidth[g] / step))
+        offsets = np.arange(-radius, radius + 1) * step
+        kernel = np.exp(-0.5 * (offsets / bandwidth[g]) ** 2) / (bandwidth[g] * np.sqrt(2 * np.pi))
+        smoothed = np.convolve(histogram[g], kernel, mode='full')[radius:radius + points] / counts[g]
+        span = (grid >= lo[g]) & (grid <= hi[g])
+        density[g, span] = smoothed[span]
+    return grid, density
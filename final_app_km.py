@@ -0,0 +1,151 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2, norm
+
+from final_app_kernels import group_codes, group_count
+
+# Vectorized Kaplan-Meier estimation for many strata at once.
+#
+# SurvivalTable sorts the distinct durations once and counts deaths and
+# removals for every (stratum, time) pair with a single bincount. The
+# number at risk is a cumulative sum along the time axis, so every stratum
+# is estimated by the same few array operations instead of one
+# KaplanMeierFitter per group. Results match lifelines: the same timeline
+# (0 plus each stratum's own durations), product-limit estimate and
+# exponential Greenwood ("log-log") confidence interval.
+#
+# The median survival table and the pairwise log-rank matrix are computed
+# from the same deaths / at-risk arrays as the curves, so the statistics
+# cost no extra pass over the patients.
+
+KMCurve = namedtuple('KMCurve', ['label', 'timeline', 'survival', 'lower', 'upper'])
+SurvivalResult = namedtuple('SurvivalResult', ['curves', 'medians', 'logrank'])
+
+
+def compact_survival(df, weight='count'):
+    # One row per distinct combination of all columns with its patient
+    # count; the estimator takes the counts as weights. Rows with missing
+    # values are dropped, as the survival tab always did.
+    keys = [c for c in df.columns if c != weight]
+    df = df.dropna()
+    codes, first = group_codes(*(df[k] for k in keys))
+    weights = df[weight].to_numpy() if weight in df.columns else None
+    compact = df.iloc[first][keys].reset_index(drop=True)
+    compact[weight] = group_count(codes, len(first), weights).astype(np.int64)
+    return compact[compact[weight] > 0].reset_index(drop=True)
+
+
+class SurvivalTable:
+
+    def __init__(self, durations, events, groups=None, weights=None):
+        durations = np.asarray(durations, dtype=float)
+        events = np.asarray(events, dtype=bool)
+        weights = np.ones(len(durations)) if weights is None else np.asarray(weights, dtype=float)
+        if groups is None:
+            codes = np.zeros(len(durations), dtype=np.intp)
+            self.labels = np.array([None], dtype=object)
+        else:
+            codes, labels = pd.factorize(pd.Series(groups), sort=True)
+            keep = codes >= 0
+            durations, events, weights, codes = durations[keep], events[keep], weights[keep], codes[keep]
+            self.labels = np.asarray(labels, dtype=object)
+
+        # The only sort: distinct durations and each row's position among them
+        self.times, time_index = np.unique(durations, return_inverse=True)
+        shape = (len(self.labels), len(self.times))
+        flat = codes * shape[1] + time_index
+        size = shape[0] * shape[1]
+        self.removed = group_count(flat, size, weights).reshape(shape)
+        self.deaths = group_count(flat, size, weights * events).reshape(shape)
+        # At risk at t: everyone in the stratum not removed before t
+        self.at_risk = self.removed.sum(axis=1, keepdims=True) - np.cumsum(self.removed, axis=1) + self.removed
+
+    def survival(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factor = np.where(self.at_risk > 0, 1 - self.deaths / self.at_risk, 1.0)
+        return np.cumprod(factor, axis=1)
+
+    def greenwood(self):
+        # Cumulative Greenwood sum; terms where everyone at risk dies are
+        # dropped, as in lifelines
+        denominator = self.at_risk * (self.at_risk - self.deaths)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terms = np.where(denominator > 0, self.deaths / denominator, 0.0)
+        return np.cumsum(terms, axis=1)
+
+
+def log_log_bounds(survival, greenwood, alpha=0.05):
+    z = norm.ppf(1 - alpha / 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        v = np.log(survival)
+        spread = z * np.sqrt(greenwood) / v
+        lower = np.exp(-np.exp(np.log(-v) - spread))
+        upper = np.exp(-np.exp(np.log(-v) + spread))
+    return np.nan_to_num(lower, nan=1.0), np.nan_to_num(upper, nan=1.0)
+
+
+def kaplan_meier(table, alpha=0.05):
+    survival = table.survival()
+    lower, upper = log_log_bounds(survival, table.greenwood(), alpha)
+    curves = []
+    for g, label in enumerate(table.labels):
+        observed = table.removed[g] > 0
+        if not observed.any():
+            continue
+        # Each curve starts at t=0 and steps at the stratum's own durations
+        at = np.flatnonzero(observed)
+        start = [] if table.times[at[0]] == 0 else [0.0]
+        curves.append(KMCurve(
+            label,
+            np.concatenate([start, table.times[at]]),
+            np.concatenate([[1.0] * len(start), survival[g, at]]),
+            np.concatenate([[1.0] * len(start), lower[g, at]]),
+            np.concatenate([[1.0] * len(start), upper[g, at]]),
+        ))
+    return curves
+
+
+def _first_time_at_or_below(timeline, values, level=0.5):
+    below = np.flatnonzero(values <= level)
+    return timeline[below[0]] if len(below) else np.inf
+
+
+def median_survival(table, curves, alpha=0.05):
+    # Median survival per stratum with the confidence interval lifelines
+    # reports: the times at which the lower and upper bands cross 0.5
+    level = f"{1 - alpha:.0%}"
+    rows = []
+    for curve in curves:
+        g = int(np.flatnonzero(table.labels == curve.label)[0]) if curve.label is not None else 0
+        rows.append({
+            'Patients': int(table.removed[g].sum()),
+            'Deaths': int(table.deaths[g].sum()),
+            'Median (months)': _first_time_at_or_below(curve.timeline, curve.survival),
+            f'Lower {level}': _first_time_at_or_below(curve.timeline, curve.lower),
+            f'Upper {level}': _first_time_at_or_below(curve.timeline, curve.upper),
+        })
+    return pd.DataFrame(rows, index=[c.label for c in curves])
+
+
+def pairwise_logrank(table):
+    # p-values of the two-sample log-rank test for every pair of strata,
+    # all pairs at once: (strata x strata x times) arrays built from the
+    # per-stratum deaths and numbers at risk
+    d_i, d_j = table.deaths[:, None, :], table.deaths[None, :, :]
+    n_i, n_j = table.at_risk[:, None, :], table.at_risk[None, :, :]
+    d, n = d_i + d_j, n_i + n_j
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = np.where(n > 0, d * n_i / n, 0.0)
+        variance = np.where(n > 1, n_i * n_j * d * (n - d) / (n * n * (n - 1)), 0.0)
+        statistic = (d_i - expected).sum(axis=2) ** 2 / variance.sum(axis=2)
+    p_values = chi2.sf(statistic, 1)
+    np.fill_diagonal(p_values, np.nan)
+    return pd.DataFrame(p_values, index=table.labels, columns=table.labels)
+
+
+def analyze(table, alpha=0.05):
+    curves = kaplan_meier(table, alpha)
+    logrank = pairwise_logrank(table) if len(table.labels) > 1 else None
+    return SurvivalResult(curves, median_survival(table, curves, alpha), logrank)
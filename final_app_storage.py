@@ -0,0 +1,474 @@
+import hashlib
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Columnar storage for the dashboard datasets.
+#
+# Every dataset lives next to its CSV as '<name>.parquet'. String columns are
+# stored dictionary-encoded (pandas 'category') and numbers in the narrowest
+# type that holds them, so a load returns the frame in its final in-memory
+# form and the tabs no longer have to re-cast columns on every rerun.
+#
+# Each written dataset also gets a statistics catalog, '<name>.stats.json':
+# per column the number of values and nulls, min/max of numeric columns and
+# the distinct values with their counts. The sidebars build their options
+# from it instead of scanning the data on every rerun.
+#
+# A columnar copy is current when the CSV is the one it was made from (or
+# that a build superseded): '<name>.parquet.source.json' records that CSV's
+# size, mtime and sha256. File mtimes alone cannot tell, since a checkout
+# sets them in any order. The same size with another mtime is settled by
+# the hash, once per process.
+#
+# The record also holds the version token of the copy's data. A converted
+# copy keeps the token of the CSV it came from, so a dataset keeps one
+# version whether its CSV or its copy is read, and the caches keyed on it
+# do not rebuild after the first conversion.
+
+COLUMNAR_EXT = '.parquet'
+STATS_EXT = '.stats.json'
+SOURCE_EXT = '.source.json'
+
+# Columns with more distinct values than this only record how many they have
+MAX_DISTINCT = 1000
+
+SURVIVAL_SCHEMA = {
+    'year_of_diagnosis': 'int16',
+    'age_group': 'category',
+    'tumor_site': 'category',
+    'adjusted_ajcc_6th_stage': 'category',
+    'adjusted_ajcc_6th_t': 'category',
+    'laterality': 'category',
+    'race': 'category',
+    'marital_status_at_diagnosis': 'category',
+    'er_status': 'category',
+    'pr_status': 'category',
+    'survival_months': 'int16',
+    'vital_status': 'category',
+}
+
+GENOME_SCHEMA = {
+    'Case': 'category',
+    'Gene': 'category',
+    'Expression': 'float32',
+    'Cancer Stage': 'category',
+    'ajcc_pathologic_n': 'category',
+    'ajcc_pathologic_m': 'category',
+    'ajcc_pathologic_t': 'category',
+    'ajcc_pathologic_stage': 'category',
+    'primary_diagnosis': 'category',
+    'age_at_diagnosis': 'float32',
+}
+
+# Declared schema per dataset. Columns that are not declared are narrowed
+# automatically (strings to category, numbers downcast).
+SCHEMAS = {
+    'seer': SURVIVAL_SCHEMA,
+    'survival df': SURVIVAL_SCHEMA,
+    'survival counts': dict(SURVIVAL_SCHEMA, count='int32'),
+    'patients by year and age': {
+        'year_of_diagnosis': 'int16',
+        'age_group': 'category',
+        'Age': 'int32',
+    },
+    'laterality vs tumor site alluvial': {
+        'laterality': 'category',
+        'tumor_site': 'category',
+        'count': 'int32',
+    },
+    'age vs site radar data': {
+        'age_group': 'category',
+    },
+    'patient counts': {
+        'year_of_diagnosis': 'int16',
+        'age_group': 'category',
+        'tumor_site': 'category',
+        'adjusted_ajcc_6th_stage': 'category',
+        'laterality': 'category',
+        'count': 'int32',
+    },
+    'genome': GENOME_SCHEMA,
+    'genome_cluster': dict(GENOME_SCHEMA, **{
+        'Cluster': 'int16',
+        'Cancer Stage Encoded': 'int8',
+        'Site Encoded': 'int8',
+    }),
+}
+
+
+def csv_path(name):
+    return name + '.csv'
+
+
+def columnar_path(name):
+    return name + COLUMNAR_EXT
+
+
+# Nullable extension type of each numpy integer type, for integer columns
+# with missing values
+NULLABLE_INTEGERS = {
+    'int8': 'Int8', 'int16': 'Int16', 'int32': 'Int32', 'int64': 'Int64',
+    'uint8': 'UInt8', 'uint16': 'UInt16', 'uint32': 'UInt32', 'uint64': 'UInt64',
+}
+
+
+def _narrow_column(s, dtype=None):
+    if dtype is None:
+        if s.dtype == object or pd.api.types.is_string_dtype(s.dtype):
+            dtype = 'category'
+        elif pd.api.types.is_integer_dtype(s.dtype):
+            return pd.to_numeric(s, downcast='integer')
+        elif pd.api.types.is_float_dtype(s.dtype):
+            return s.astype('float32')
+        else:
+            return s
+    if dtype == 'category':
+        return s if isinstance(s.dtype, pd.CategoricalDtype) else s.astype('category')
+    if s.dtype == dtype or str(s.dtype) == NULLABLE_INTEGERS.get(dtype):
+        return s
+    if np.dtype(dtype).kind in 'iu':
+        if s.isna().any():
+            # Integer columns with missing values become the nullable type
+            return s.astype(NULLABLE_INTEGERS[dtype])
+        if pd.api.types.is_float_dtype(s.dtype):
+            s = s.round()
+    return s.astype(dtype)
+
+
+def apply_schema(df, name):
+    schema = SCHEMAS.get(name, {})
+    for col in df.columns:
+        df[col] = _narrow_column(df[col], schema.get(col))
+    return df
+
+
+def read_csv(name, **kwargs):
+    schema = SCHEMAS.get(name, {})
+    # Parse declared string columns straight into categories so the raw
+    # object column is never materialized
+    dtype = {col: 'category' for col, t in schema.items() if t == 'category'}
+    df = pd.read_csv(csv_path(name), dtype=dtype, **kwargs)
+    return apply_schema(df, name)
+
+
+def write_dataset(name, df, fingerprint=None):
+    # `fingerprint`: the CSV's fingerprint from before it was read, when df
+    # is its conversion; by default the copy is new data that supersedes
+    # the CSV there is now
+    df = apply_schema(df.reset_index(drop=True), name)
+    tmp = columnar_path(name) + '.tmp'
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, columnar_path(name))
+    record_source(name, fingerprint)
+    write_stats(name, df)
+    return df
+
+
+def _arrow_type(dtype):
+    import pyarrow as pa
+    if dtype == 'category':
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.from_numpy_dtype(np.dtype(dtype))
+
+
+class DatasetWriter:
+    # Streams chunks of a dataset into its columnar file so that tables
+    # larger than memory can be written one piece at a time. Chunks may
+    # arrive with different category sets; every chunk is cast to the
+    # declared schema and the file only replaces the old one on close().
+    # The statistics catalog is summed up chunk by chunk and written on
+    # close() as well.
+
+    def __init__(self, name, columns):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        schema = SCHEMAS.get(name, {})
+        self.name = name
+        self.schema = pa.schema([(col, _arrow_type(schema.get(col, 'category'))) for col in columns])
+        self.tmp = columnar_path(name) + '.tmp'
+        self.writer = pq.ParquetWriter(self.tmp, self.schema)
+        self.rows = 0
+        self.dtypes = {col: schema.get(col, 'category') for col in columns}
+        self.counts = {col: pd.Series(dtype='int64') for col in columns}
+
+    def write(self, df):
+        import pyarrow as pa
+        df = apply_schema(df[self.schema.names].reset_index(drop=True), self.name)
+        self.writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+        self.rows += len(df)
+        self._count(df)
+
+    def copy_from(self, path):
+        # Carries over the rows of an earlier build without re-parsing them
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches():
+            batch = batch.cast(self.schema)
+            self.writer.write_batch(batch)
+            self.rows += batch.num_rows
+            self._count(apply_schema(batch.to_pandas(), self.name))
+
+    def _count(self, df):
+        for col in df.columns:
+            self.dtypes[col] = df[col].dtype
+            self.counts[col] = self.counts[col].add(value_counts(df[col]), fill_value=0)
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.tmp, columnar_path(self.name))
+        record_source(self.name)
+        save_stats(self.name, {
+            'version': dataset_version(self.name),
+            'rows': self.rows,
+            'columns': {col: counted_stats(self.dtypes[col], self.rows, self.counts[col]) for col in self.counts},
+        })
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.writer.close()
+            os.remove(self.tmp)
+
+
+def read_record(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_record(path, record):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(record, f, indent=2)
+    os.replace(tmp, path)
+
+
+def source_record_path(name):
+    return columnar_path(name) + SOURCE_EXT
+
+
+def csv_fingerprint(name):
+    # Size and mtime of the dataset's CSV; None without one
+    try:
+        st = os.stat(csv_path(name))
+    except FileNotFoundError:
+        return None
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+# (path, size, mtime_ns) -> sha256 of the CSVs hashed by this process
+_csv_hashes = {}
+
+
+def _csv_hash(name, fingerprint):
+    # sha256 of the CSV while it still has `fingerprint`, else None
+    key = (csv_path(name), fingerprint['size'], fingerprint['mtime_ns'])
+    if key not in _csv_hashes:
+        digest = content_hash(csv_path(name))
+        if csv_fingerprint(name) != fingerprint:
+            return None
+        _csv_hashes[key] = digest
+    return _csv_hashes[key]
+
+
+def file_version(path):
+    st = os.stat(path)
+    return f"{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def csv_version(name, fingerprint):
+    return f"{csv_path(name)}:{fingerprint['size']}:{fingerprint['mtime_ns']}"
+
+
+def record_source(name, fingerprint=None, version=None):
+    # Records the CSV the columnar copy of `name` is current for, and the
+    # version of its data: the CSV's for a conversion (`fingerprint` given),
+    # the copy's own for new data, unless `version` is given
+    if version is None:
+        version = file_version(columnar_path(name)) if fingerprint is None else csv_version(name, fingerprint)
+    fingerprint = csv_fingerprint(name) if fingerprint is None else fingerprint
+    if fingerprint is not None:
+        digest = _csv_hash(name, fingerprint)
+        if digest is None:
+            # The CSV changed while it was read: leave the copy stale
+            if os.path.exists(source_record_path(name)):
+                os.remove(source_record_path(name))
+            return
+        fingerprint = dict(fingerprint, sha256=digest)
+    write_record(source_record_path(name), {'csv': fingerprint, 'version': version})
+
+
+def columnar_is_current(name):
+    if not os.path.exists(columnar_path(name)):
+        return False
+    fingerprint = csv_fingerprint(name)
+    if fingerprint is None:
+        return True
+    recorded = (read_record(source_record_path(name)) or {}).get('csv')
+    if not recorded or recorded['size'] != fingerprint['size']:
+        return False
+    if recorded['mtime_ns'] == fingerprint['mtime_ns']:
+        return True
+    # Same size, other mtime (a checkout or copy): compare the contents
+    return _csv_hash(name, fingerprint) == recorded.get('sha256')
+
+
+def dataset_version(name):
+    # Cheap version token of the data read_dataset would load, the same
+    # whether it reads the CSV or its copy. It changes whenever the data is
+    # rewritten, so caches keyed on it pick up refreshed data without a
+    # server restart.
+    if columnar_is_current(name):
+        record = read_record(source_record_path(name)) or {}
+        return record.get('version') or file_version(columnar_path(name))
+    fingerprint = csv_fingerprint(name)
+    return None if fingerprint is None else csv_version(name, fingerprint)
+
+
+def content_hash(path, size=None, block_size=2**22):
+    # sha256 of the first `size` bytes of a file (the whole file by default)
+    digest = hashlib.sha256()
+    remaining = os.path.getsize(path) if size is None else size
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            data = f.read(min(block_size, remaining))
+            if not data:
+                break
+            digest.update(data)
+            remaining -= len(data)
+    return digest.hexdigest()
+
+
+def stats_path(name):
+    return name + STATS_EXT
+
+
+def _plain(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+def value_counts(s):
+    # Non-null value counts of a column, on a plain index so that the counts
+    # of chunks with different category sets can be added up
+    counts = s.value_counts(sort=False)
+    counts = counts[counts > 0]
+    counts.index = counts.index.astype(object)
+    return counts
+
+
+def counted_stats(dtype, rows, counts):
+    # Column statistics from the column's length and value counts
+    count = int(counts.sum())
+    stats = {
+        'dtype': str(dtype),
+        'count': count,
+        'nulls': rows - count,
+        'null_rate': (rows - count) / rows if rows else 0.0,
+    }
+    if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype) and count:
+        stats['min'], stats['max'] = _plain(counts.index.min()), _plain(counts.index.max())
+    stats['distinct'] = len(counts)
+    if len(counts) <= MAX_DISTINCT:
+        stats['values'] = [[_plain(v), int(n)] for v, n in counts.items()]
+    return stats
+
+
+def column_stats(s):
+    return counted_stats(s.dtype, len(s), value_counts(s))
+
+
+def dataset_stats(name, df):
+    return {
+        'version': dataset_version(name),
+        'rows': len(df),
+        'columns': {col: column_stats(df[col]) for col in df.columns},
+    }
+
+
+def write_stats(name, df):
+    return save_stats(name, dataset_stats(name, df))
+
+
+def save_stats(name, stats):
+    tmp = stats_path(name) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(stats, f)
+    os.replace(tmp, stats_path(name))
+    return stats
+
+
+def read_stats(name):
+    # Statistics catalog of a dataset, rebuilt from the data when it is
+    # missing or older than the file read_dataset loads; None when the
+    # dataset does not exist
+    version = dataset_version(name)
+    if version is None:
+        return None
+    try:
+        with open(stats_path(name)) as f:
+            stats = json.load(f)
+        if stats.get('version') == version:
+            return stats
+    except (OSError, ValueError):
+        pass
+    df = read_dataset(name)
+    try:
+        return write_stats(name, df)
+    except OSError:
+        return dataset_stats(name, df)
+
+
+def read_dataset(name):
+    if columnar_is_current(name):
+        return apply_schema(pd.read_parquet(columnar_path(name)), name)
+    fingerprint = csv_fingerprint(name)
+    df = read_csv(name)
+    try:
+        write_dataset(name, df, fingerprint)
+    except (OSError, ImportError):
+        # Read-only deployments still work from the CSV
+        pass
+    return df
+
+
+def convert(names):
+    for name in names:
+        fingerprint = csv_fingerprint(name)
+        df = write_dataset(name, read_csv(name), fingerprint)
+        print(f"{name}: {len(df):,} rows -> {columnar_path(name)}, {stats_path(name)}")
+
+
+def _measure(load):
+    start = time.perf_counter()
+    df = load()
+    seconds = time.perf_counter() - start
+    return seconds, df.memory_usage(deep=True).sum() / 2**20
+
+
+def benchmark(names):
+    for name in names:
+        csv_s, csv_mb = _measure(lambda: pd.read_csv(csv_path(name)))
+        if not columnar_is_current(name):
+            write_dataset(name, read_csv(name))
+        col_s, col_mb = _measure(lambda: pd.read_parquet(columnar_path(name)))
+        print(f"{name}")
+        print(f"  csv      load {csv_s:8.3f} s   memory {csv_mb:9.1f} MB")
+        print(f"  {COLUMNAR_EXT[1:]:<8} load {col_s:8.3f} s   memory {col_mb:9.1f} MB")
+
+
+if __name__ == '__main__':
+    # python final_app_storage.py [--benchmark] [dataset ...]
+    args = sys.argv[1:]
+    if args and args[0] == '--benchmark':
+        benchmark(args[1:] or ['seer', 'genome_cluster'])
+    else:
+        convert(args or list(SCHEMAS))
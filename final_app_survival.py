@@ -7,6 +7,7 @@ import scipy.stats
 from lifelines import KaplanMeierFitter
 from PIL import Image
 from final_app_genome import genome_dashboard
+from final_app_common import filter_data
 
 #st.set_page_config(page_title="Breast Cancer Dashboard", layout="wide")
 
@@ -64,33 +65,17 @@ def survival_dashboard():
     tumor_sites_selected = st.sidebar.multiselect("Tumor Site", tumor_site_options)
     stage_selected = st.sidebar.multiselect("Stage", stage_options)
 
-    # Apply filters
-    def filter_df(df):
-        if 'year_of_diagnosis' in df.columns:
-            df = df[
-                (df["year_of_diagnosis"] >= year_range[0]) &
-                (df["year_of_diagnosis"] <= year_range[1])
-            ]
-        if 'age_group' in df.columns and age_groups_selected:
-            df = df[df["age_group"].isin(age_groups_selected)]
-        if 'tumor_site' in df.columns and tumor_sites_selected:
-            df = df[df["tumor_site"].isin(tumor_sites_selected)]
-        if 'adjusted_ajcc_6th_stage' in df.columns and stage_selected:
-            df = df[df["adjusted_ajcc_6th_stage"].isin(stage_selected)]
-        return df
+    filters = {
+        'year_of_diagnosis': year_range,
+        'age_group': age_groups_selected,
+        'tumor_site': tumor_sites_selected,
+        'adjusted_ajcc_6th_stage': stage_selected,
+    }
 
     # filter all dfs
-    demographics_df = load_data('patients by year and age')
-    demographics_df.year_of_diagnosis = demographics_df.year_of_diagnosis.astype(int)
-    demographics_df.age_group = demographics_df.age_group.astype(str)
-    demographics_df = filter_df(demographics_df)
-
-    alluvial_data = load_data('laterality vs tumor site alluvial')
-    alluvial_data = filter_df(alluvial_data)
-
-    radar_data = load_data('age vs site radar data')
-    radar_data = radar_data.melt(id_vars='age_group', var_name='tumor_site', value_name='count')
-    radar_data = filter_df(radar_data)
+    demographics_df = filter_data('patients by year and age', filters)
+    alluvial_data = filter_data('laterality vs tumor site alluvial', filters)
+    radar_data = filter_data('age vs site radar data', filters, prepare='melt_radar')
 
     # Create Tabs
     st.markdown("<div style='margin-top: 0px;'></div>", unsafe_allow_html=True)
@@ -101,7 +86,7 @@ def survival_dashboard():
         st.session_state.active_tab = 'Demographics'
         st.subheader("Number of Patients by Year and Age Group")
         print(demographics_df.head())
-        df1 = demographics_df.groupby(['year_of_diagnosis', 'age_group'])['Age'].sum().reset_index()
+        df1 = demographics_df.groupby(['year_of_diagnosis', 'age_group'], observed=True)['Age'].sum().reset_index()
         print(df1.head())
         print(df1.shape)
         df1 = df1.rename(columns = {'Age' : 'Number of Patients', 'year_of_diagnosis' : 'Year of Diagnosis', 'age_group' : 'Age Group'})
@@ -262,10 +247,7 @@ def survival_dashboard():
                 help=""
             )
 
-        survival_df = load_data('survival df')
-        survival_df = survival_df.dropna()
-        sdf = filter_df(survival_df)
-        sdf.survival_months = sdf.survival_months.astype(int)
+        sdf = filter_data('survival df', filters, prepare='drop_missing')
 
         # If there's no survival data after filtering, just skip
         if sdf.empty:
@@ -2,31 +2,111 @@ from final_app_common import *
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
-from lifelines import KaplanMeierFitter
+import numpy as np
+from final_app_km import SurvivalTable, analyze
+from final_app_cache import normalized_filters
+
+excluded_strata = ['Unknown', 'unknown', 0, '0']
+
+col_map = {
+    'Race/Ethnicity' : 'race',
+    'Marital Status' : 'marital_status_at_diagnosis',
+    'Stage' : 'adjusted_ajcc_6th_stage',
+    'Laterality' : 'laterality',
+    'Tumor Site' : 'tumor_site',
+    'Tumor Size' : 'adjusted_ajcc_6th_t',
+    'ER Status' : 'er_status',
+    'PR Status' : 'pr_status',
+}
+
+
+def fit_survival(filters, col):
+    # Kaplan-Meier curves, median survival and pairwise log-rank p-values
+    # for the filtered cohort, one stratum per value of `col` (a single
+    # curve when col is None); None when no patients match
+    return fit_survival_frame(survival_data(filters), col)
+
+
+def fit_survival_frame(sdf, col):
+    if sdf.empty:
+        return None
+    durations = sdf.survival_months.to_numpy()
+    events = (sdf.vital_status == 'Dead').to_numpy()
+    weights = sdf['count'].to_numpy()
+    if col is None:
+        return analyze(SurvivalTable(durations, events, weights=weights))
+    keep = ~sdf[col].isin(excluded_strata).to_numpy()
+    return analyze(SurvivalTable(durations[keep], events[keep], sdf[col].array[keep], weights[keep]))
+
+
+def survival_results(filters, col):
+    # Memoized across sessions on the data version and normalized filters;
+    # a miss is filtered and fitted on the shared compute executor
+    path, prepare = survival_source()
+    key = (path, dataset_version(path), normalized_filters(filters), col)
+    cache = curve_cache()
+    if key in cache:
+        # Already fitted: answered on the script thread (refitted there only
+        # if it was evicted in the meantime)
+        return cache.get_or_compute(key, lambda: fit_survival(filters, col))
+    df, index = indexed_data(path, prepare)
+    return run_compute('survival', lambda: cache.get_or_compute(
+        key, lambda: fit_survival_frame(index.apply(df, filters), col)))
+
+
+def common_views():
+    # (filters, stratum column) of the views most sessions open first: every
+    # "Survival Curve by" option for the untouched sidebar and for a single
+    # value picked in one of its multiselects
+    options = filter_options()
+    default = default_filters(options)
+    views = [default]
+    for col, values in options.items():
+        if col != 'year_of_diagnosis':
+            views += [dict(default, **{col: [value]}) for value in values]
+    return [(filters, col) for filters in views for col in [None] + list(col_map.values())]
+
+
+def warm_survival_views(workers=2):
+    # Fits the common views into the shared curve cache on the compute
+    # executor, so they count against its slots like any tab's work. At
+    # most `workers` views are queued at a time, one per warmer owner, and
+    # the next one is only submitted once the owner's last has finished.
+    # Runs on the survival warmer's thread (see final_app_common), which
+    # waits for the jobs and logs their failures.
+    path, prepare = survival_source()
+    version = dataset_version(path)
+    df, index = indexed_data(path, prepare)
+    cache = curve_cache()
+    executor = compute_executor()
+
+    def warm(filters, col):
+        key = (path, version, normalized_filters(filters), col)
+        if key not in cache:
+            cache.get_or_compute(key, lambda: fit_survival_frame(index.apply(df, filters), col))
+
+    def finish(job):
+        try:
+            job.result()
+        except Exception:
+            logger.exception("survival view warm-up failed")
+
+    views = common_views()
+    pending = []
+    for i, (filters, col) in enumerate(views):
+        if len(pending) == workers:
+            finish(pending.pop(0))
+        pending.append(executor.submit(('survival warmer', i % workers), lambda f=filters, c=col: warm(f, c)))
+    for job in pending:
+        finish(job)
+    return len(views)
+
 
 def survival_analysis():
     tabs()
     st.sidebar.title("Filters")
     print(st.session_state.active_tab)
-    year_range = st.sidebar.slider("Year Range", min_value=min_year, max_value=max_year, value=(min_year, max_year))
-    age_groups_selected = st.sidebar.multiselect("Age Groups", age_group_options)
-    tumor_sites_selected = st.sidebar.multiselect("Tumor Site", tumor_site_options)
-    stage_selected = st.sidebar.multiselect("Stage", stage_options)
-
-    # Apply filters
-    def filter_df(df):
-        if 'year_of_diagnosis' in df.columns:
-            df = df[
-                (df["year_of_diagnosis"] >= year_range[0]) &
-                (df["year_of_diagnosis"] <= year_range[1])
-            ]
-        if 'age_group' in df.columns and age_groups_selected:
-            df = df[df["age_group"].isin(age_groups_selected)]
-        if 'tumor_site' in df.columns and tumor_sites_selected:
-            df = df[df["tumor_site"].isin(tumor_sites_selected)]
-        if 'adjusted_ajcc_6th_stage' in df.columns and stage_selected:
-            df = df[df["adjusted_ajcc_6th_stage"].isin(stage_selected)]
-        return df
+    filters = sidebar_filters()
 
     # Create Tabs
     st.markdown("<div style='margin-top: 0px;'></div>", unsafe_allow_html=True)
@@ -89,17 +169,14 @@ def survival_analysis():
         </div>
         """, unsafe_allow_html=True)
 
-    col_map = {
-        'Race/Ethnicity' : 'race',
-        'Marital Status' : 'marital_status_at_diagnosis',
-        'Stage' : 'adjusted_ajcc_6th_stage',
-        'Laterality' : 'laterality',
-        'Tumor Site' : 'tumor_site',
-        'Tumor Size' : 'adjusted_ajcc_6th_t',
-        'ER Status' : 'er_status',
-        'PR Status' : 'pr_status',
-    }
+    survival_chart(filters)
+
 
+# The stratum selector reruns only this fragment: the page header and the
+# sidebar stay as they are, and `filters` is the sidebar state of the last
+# full run
+@st.fragment
+def survival_chart(filters):
     gap, _ = st.columns([0.4, 0.6])
     with gap:
         chart_col = st.selectbox(
@@ -109,45 +186,34 @@ def survival_analysis():
             help=""
         )
 
-    survival_df = load_data('survival df')
-    survival_df = survival_df.dropna()
-    sdf = filter_df(survival_df)
-    sdf.survival_months = sdf.survival_months.astype(int)
+    col = col_map.get(chart_col)
+    results = survival_results(filters, col)
 
     # If there's no survival data after filtering, just skip
-    if sdf.empty:
+    if results is None:
         st.write("No survival data available with current filters.")
     else:
-        kmf = KaplanMeierFitter()
-        if chart_col == 'Time (months)':
-            kmf.fit(sdf.survival_months, event_observed=(sdf.vital_status == 'Dead'))
-            fig = go.Figure()
+        curves = results.curves
+        fig = go.Figure()
+        if col is None:
             fig.add_trace(go.Scatter(
-                x=kmf.survival_function_.index,
-                y=kmf.survival_function_['KM_estimate'],
+                x=curves[0].timeline,
+                y=curves[0].survival,
                 mode='lines',
                 name='Survival Probability'
             ))
         else:
-            fig = go.Figure()
-            col = col_map[chart_col]
-            for val in set(sdf[col].unique()) - {'Unknown', 'unknown', 0, '0'}:
-                x = sdf[sdf[col] == val]
-                kmf.fit(
-                    x.survival_months, 
-                    event_observed=(x.vital_status == 'Dead')
-                )
+            for curve in curves:
                 fig.add_trace(go.Scatter(
-                    x=kmf.survival_function_.index,
-                    y=kmf.survival_function_['KM_estimate'],
+                    x=curve.timeline,
+                    y=curve.survival,
                     mode='lines',
-                    name=val,
+                    name=curve.label,
                     line=dict(width=2)
                 ))
                 fig.add_trace(go.Scatter(
-                    x=list(kmf.confidence_interval_.index) + list(kmf.confidence_interval_.index[::-1]),
-                    y=list(kmf.confidence_interval_['KM_estimate_lower_0.95']) + 
-                    list(kmf.confidence_interval_['KM_estimate_upper_0.95'][::-1]),
+                    x=np.concatenate([curve.timeline, curve.timeline[::-1]]),
+                    y=np.concatenate([curve.lower, curve.upper[::-1]]),
                     fill='toself',
                     fillcolor='rgba(0,100,250,0.07)',
                     line=dict(width=0),
@@ -165,3 +231,14 @@ def survival_analysis():
             height=600
         )
         st.plotly_chart(fig, use_container_width=True)
+
+        stats_col1, stats_col2 = st.columns([0.45, 0.55])
+        with stats_col1:
+            st.subheader("Median Survival")
+            st.dataframe(results.medians, use_container_width=True)
+        with stats_col2:
+            st.subheader("Pairwise Log-Rank Test (p-values)")
+            if results.logrank is not None:
+                st.dataframe(results.logrank.style.format("{:.4f}", na_rep=""), use_container_width=True)
+            else:
+                st.write("Select a grouping to compare survival curves.")
@@ -1,17 +1,22 @@
-from final_app_demographics import demographics
-from final_app_tumor import tumor_characteristics
-from final_app_survival_analysis import survival_analysis
-from final_app_genome import genome_dashboard
-
 import streamlit as st
 
+from final_app_warmup import import_module, start_server
+
+# Page -> (module, function). A page's module, and the libraries it pulls
+# in (sklearn, scipy, lifelines, ...), are only imported the first time the
+# page is shown; later reruns find it in sys.modules. Imports go through
+# the warm-up's import lock (see final_app_warmup).
+pages = {
+    'Dashboard': ('final_app_demographics', 'demographics'),
+    'Demographics': ('final_app_demographics', 'demographics'),
+    'Tumor': ('final_app_tumor', 'tumor_characteristics'),
+    'Survival': ('final_app_survival_analysis', 'survival_analysis'),
+    'Genome': ('final_app_genome', 'genome_dashboard'),
+}
+
 
 def all_tabs():
-    if st.session_state.page in ['Dashboard', 'Demographics']:
-        demographics()
-    if st.session_state.page == 'Tumor':
-        tumor_characteristics()
-    if st.session_state.page == 'Survival':
-        survival_analysis()
-    if st.session_state.page == 'Genome':
-        genome_dashboard()
\ No newline at end of file
+    start_server()
+    if st.session_state.page in pages:
+        module, function = pages[st.session_state.page]
+        getattr(import_module(module), function)()
@@ -8,33 +8,12 @@ def tumor_characteristics():
     # Sidebar filters
     st.sidebar.title("Filters")
     print(st.session_state.active_tab)
-    year_range = st.sidebar.slider("Year Range", min_value=min_year, max_value=max_year, value=(min_year, max_year))
-    age_groups_selected = st.sidebar.multiselect("Age Groups", age_group_options)
-    tumor_sites_selected = st.sidebar.multiselect("Tumor Site", tumor_site_options)
-    stage_selected = st.sidebar.multiselect("Stage", stage_options)
+    filters = sidebar_filters()
 
-    # Apply filters
-    def filter_df(df):
-        if 'year_of_diagnosis' in df.columns:
-            df = df[
-                (df["year_of_diagnosis"] >= year_range[0]) &
-                (df["year_of_diagnosis"] <= year_range[1])
-            ]
-        if 'age_group' in df.columns and age_groups_selected:
-            df = df[df["age_group"].isin(age_groups_selected)]
-        if 'tumor_site' in df.columns and tumor_sites_selected:
-            df = df[df["tumor_site"].isin(tumor_sites_selected)]
-        if 'adjusted_ajcc_6th_stage' in df.columns and stage_selected:
-            df = df[df["adjusted_ajcc_6th_stage"].isin(stage_selected)]
-        return df
-
-    # filter all dfs
-    alluvial_data = load_data('laterality vs tumor site alluvial')
-    alluvial_data = filter_df(alluvial_data)
-
-    radar_data = load_data('age vs site radar data')
-    radar_data = radar_data.melt(id_vars='age_group', var_name='tumor_site', value_name='count')
-    radar_data = filter_df(radar_data)
+    alluvial_cube = load_cube('laterality vs tumor site alluvial').select(filters)
+    alluvial_data = alluvial_cube.rollup(['laterality', 'tumor_site'])
+    radar_cube = load_cube('age vs site radar data').select(filters)
+    radar_data = radar_cube.rollup(['age_group', 'tumor_site'], keep_zeros=radar_cube.total() > 0)
 
     st.markdown("<div style='margin-top: 0px;'></div>", unsafe_allow_html=True)
     st.subheader("Laterality vs Tumor Site")
@@ -0,0 +1,82 @@
+import plotly.graph_objects as go
+
+from final_app_cache import LRUCache, nbytes, normalized_filters
+from final_app_storage import dataset_version
+
+# Declarative chart views.
+#
+# A view is a function that builds one chart (or the data behind several)
+# and declares what it depends on: `inputs`, the keys of the page state it
+# reads; `datasets`, whose versions it was built from; and `views`, other
+# views whose results it takes. Its result is memoized under a key made of
+# those dependencies only, so on a rerun a view is rebuilt exactly when
+# something it declared changed and every other view is a cache hit. A
+# dependency on another view is keyed by that view's own key, not by its
+# result. A ViewSet is created once per process, when its page module is
+# imported, and its cache is shared by all sessions.
+#
+# Values a view needs that are not hashable (the genome matrix, re-fitted
+# cluster labels) are declared as `resources` and passed to get(); they
+# must be determined by the view's inputs and datasets.
+#
+#   views = ViewSet(max_bytes=32 * 2**20)
+#
+#   @views.view(inputs=['selections', 'genes'], datasets=['genome_cluster'], resources=['genome'])
+#   def genome_cases(selections, genes, genome):
+#       ...
+#
+#   views.get('genome_cases', state, genome=genome)
+
+
+class View:
+
+    def __init__(self, name, build, inputs=(), datasets=(), views=(), resources=()):
+        self.name = name
+        self.build = build
+        self.inputs = tuple(inputs)
+        self.datasets = tuple(datasets)
+        self.views = tuple(views)
+        self.resources = tuple(resources)
+
+
+def figure_nbytes(value):
+    # Cached figures are sized by their trace data
+    if isinstance(value, go.Figure):
+        return sum(nbytes(trace.to_plotly_json()) for trace in value.data)
+    return nbytes(value)
+
+
+class ViewSet:
+
+    def __init__(self, max_bytes):
+        self.cache = LRUCache(max_bytes, sizeof=figure_nbytes)
+        self.views = {}
+
+    def view(self, inputs=(), datasets=(), views=(), resources=(), name=None):
+        def register(build):
+            view = View(name or build.__name__, build, inputs, datasets, views, resources)
+            self.views[view.name] = view
+            return build
+        return register
+
+    def key(self, name, state):
+        view = self.views[name]
+        return (
+            name,
+            tuple(dataset_version(d) for d in view.datasets),
+            normalized_filters({k: state.get(k) for k in view.inputs}),
+            tuple(self.key(v, state) for v in view.views),
+        )
+
+    def get(self, name, state, **resources):
+        # The view's result for `state`, built only when no result for the
+        # same dependencies is cached. Results are shared and read-only.
+        view = self.views[name]
+
+        def build():
+            args = {k: state.get(k) for k in view.inputs}
+            args.update({v: self.get(v, state, **resources) for v in view.views})
+            args.update({r: resources[r] for r in view.resources})
+            return view.build(**args)
+
+        return self.cache.get_or_compute(self.key(name, state), build)
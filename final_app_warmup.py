@@ -0,0 +1,252 @@
+import importlib
+import json
+import logging
+import os
+import pickle
+import stat
+import sys
+import threading
+import time
+
+# Warm start for new server processes.
+#
+#   python final_app_warmup.py            prepare everything, write the snapshot
+#   python final_app_warmup.py --status   readiness probe: exit 0 once a server is ready
+#
+# Warm-up converts every dataset to its columnar form, writes the statistics
+# catalogs and the genome matrix, and builds the structures the tabs derive
+# from the data (prepared and indexed frames, the count cube, the heatmap
+# statistics). Those are pickled together with the data version each was
+# built from into one snapshot. A server process reads the snapshot the
+# first time one of the cached loaders in final_app_common runs; they take
+# an entry from it instead of rebuilding when its version still matches the
+# data, so the first user of each tab does not pay for parsing and
+# preparing.
+#
+# Readiness is reported by the server processes themselves. The first
+# tab page shown by a process starts its warm-up, which loads every
+# structure above into the process's caches and then starts fitting the
+# common Survival views in the background, and a heartbeat that rewrites
+# 'server-<pid>.json' every few seconds with the process's ready flag. The
+# probe reads those files and is ready when a live server is. The status
+# also carries the counters of the process's shared caches and pools.
+# The homepage does not start the warm-up, which imports the tabs'
+# libraries, unless FINAL_APP_WARMUP=1 asks for it: set it where a
+# readiness probe must see the server ready before anyone opens a tab.
+#
+# The snapshot and the status files live in a state directory outside the
+# app's directory ($FINAL_APP_STATE_DIR, by default ~/.cache/final_app).
+# The snapshot is only unpickled when it starts with the current format
+# header and is owned by this user and writable by no one else.
+
+STATE_DIR = os.environ.get('FINAL_APP_STATE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'final_app')
+SNAPSHOT_PATH = os.path.join(STATE_DIR, 'warmup.snapshot.pkl')
+SNAPSHOT_HEADER = b'final_app warmup snapshot 1\n'
+HEARTBEAT_SECONDS = 5
+WARMUP_AT_START = os.environ.get('FINAL_APP_WARMUP') == '1'
+
+logger = logging.getLogger(__name__)
+
+_snapshot = None
+_lock = threading.Lock()
+
+# Held while a page module is imported (see final_app_tabs) and while the
+# warm-up thread imports the tabs' modules, so that two threads never
+# import modules that import each other at the same time
+import_lock = threading.RLock()
+
+
+def import_module(name):
+    with import_lock:
+        return importlib.import_module(name)
+
+
+def state_path(name):
+    os.makedirs(STATE_DIR, mode=0o700, exist_ok=True)
+    return os.path.join(STATE_DIR, name)
+
+
+def _trusted(f):
+    st = os.fstat(f.fileno())
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _load_snapshot(path=SNAPSHOT_PATH):
+    try:
+        with open(path, 'rb') as f:
+            if not _trusted(f) or f.read(len(SNAPSHOT_HEADER)) != SNAPSHOT_HEADER:
+                return {}
+            with import_lock:
+                # Unpickling imports the modules of the pickled classes
+                return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        # No snapshot, or one from an older version of the code: build lazily
+        return {}
+
+
+def from_snapshot(key, version, build):
+    # The snapshot's entry for `key` when it was built from `version` of the
+    # data, otherwise build(). Entries are handed out once: the caller's
+    # cache keeps them from then on.
+    global _snapshot
+    with _lock:
+        if _snapshot is None:
+            _snapshot = _load_snapshot()
+        entry = _snapshot.pop(key, None)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    return build()
+
+
+def targets():
+    # (snapshot key, dataset name, builder taking the version) of every
+    # structure worth keeping in the snapshot
+    import final_app_common as common
+    survival_path, survival_prepare = common.survival_source()
+    found = [
+        (('indexed', survival_path, survival_prepare), survival_path,
+         lambda v: common._load_indexed(survival_path, v, survival_prepare)),
+        (('genome_stats', 'genome_cluster'), 'genome_cluster',
+         lambda v: common._load_genome_stats('genome_cluster', v)),
+    ]
+    for source in sorted({common.cube_source(table) for table in common.chart_tables}):
+        found.append((('cube', source), source, lambda v, source=source: common._load_cube(source, v)))
+    return found
+
+
+def prepare(snapshot_path=SNAPSHOT_PATH):
+    os.makedirs(os.path.dirname(snapshot_path), mode=0o700, exist_ok=True)
+    from final_app_genome_data import read_matrix
+    from final_app_storage import SCHEMAS, csv_path, columnar_path, dataset_version, read_stats
+
+    started = time.perf_counter()
+    for name in SCHEMAS:
+        if os.path.exists(csv_path(name)) or os.path.exists(columnar_path(name)):
+            read_stats(name)
+            print(f"  {name}: columnar copy and statistics current")
+    if dataset_version('genome_cluster') is not None:
+        read_matrix('genome_cluster')
+        print("  genome_cluster: matrix current")
+
+    entries = {}
+    for key, name, build in targets():
+        version = dataset_version(name)
+        if version is None:
+            continue
+        entries[key] = (version, build(version))
+        print(f"  {' / '.join(str(k) for k in key if k is not None)}: prepared")
+
+    tmp = snapshot_path + '.tmp'
+    with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+        f.write(SNAPSHOT_HEADER)
+        pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, snapshot_path)
+    print(f"snapshot written to {snapshot_path} ({os.path.getsize(snapshot_path) / 2**20:.1f} MB) "
+          f"in {time.perf_counter() - started:.1f} s")
+
+
+_server = None
+_server_lock = threading.Lock()
+_server_changed = threading.Event()
+
+
+def start_server():
+    # Called on every tab page run (and every run when WARMUP_AT_START); the
+    # first one in a process starts its warm-up and heartbeat
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return
+        _server = {'pid': os.getpid(), 'ready': False, 'started': time.time()}
+    threading.Thread(target=_warm_server, name='warmup', daemon=True).start()
+    threading.Thread(target=_heartbeat, name='warmup-heartbeat', daemon=True).start()
+
+
+def _warm_server():
+    started = time.perf_counter()
+    try:
+        common = import_module('final_app_common')
+        from final_app_storage import dataset_version
+        for _, name, build in targets():
+            version = dataset_version(name)
+            if version is not None:
+                build(version)
+        # Fits the common Survival views in the background
+        common.start_survival_warmer()
+    except Exception as e:
+        logger.exception("server warm-up failed")
+        _server['error'] = repr(e)
+    else:
+        _server['warmup_seconds'] = round(time.perf_counter() - started, 2)
+        _server['ready'] = True
+    _server_changed.set()
+
+
+# Name -> function returning the counters of a shared cache or pool of this
+# process, reported with its readiness
+_reporters = {}
+
+
+def report(name, stats):
+    _reporters[name] = stats
+
+
+def server_status():
+    return dict(_server or {}, updated=time.time(), stats={name: stats() for name, stats in list(_reporters.items())})
+
+
+def _heartbeat():
+    path = state_path(f"server-{os.getpid()}.json")
+    while True:
+        try:
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(server_status(), f, indent=2)
+            os.replace(tmp, path)
+        except Exception:
+            logger.exception("could not write the server status")
+        # Written again right away when the warm-up finishes
+        _server_changed.wait(HEARTBEAT_SECONDS)
+        _server_changed.clear()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def status():
+    # Ready when a running server process has finished its warm-up
+    servers = []
+    try:
+        names = sorted(os.listdir(STATE_DIR))
+    except OSError:
+        names = []
+    for name in names:
+        if not (name.startswith('server-') and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(STATE_DIR, name)) as f:
+                server = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if _alive(server.get('pid', 0)) and time.time() - server.get('updated', 0) < 3 * HEARTBEAT_SECONDS:
+            servers.append(server)
+    if not servers:
+        return {'ready': False, 'reason': 'no server running', 'servers': []}
+    ready = any(server.get('ready') for server in servers)
+    return {'ready': ready, 'servers': servers} if ready else \
+        {'ready': False, 'reason': 'servers still warming up', 'servers': servers}
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--status']:
+        result = status()
+        print(json.dumps(result))
+        sys.exit(0 if result['ready'] else 1)
+    prepare()
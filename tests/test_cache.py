@@ -0,0 +1,54 @@
+import threading
+import time
+
+import numpy as np
+
+from final_app_cache import LRUCache, SingleFlight, normalized_filters
+
+
+def test_normalized_filters_ignore_selection_order():
+    a = normalized_filters({'race': ['b', 'a'], 'year': (2000, 2010), 'site': []})
+    b = normalized_filters({'site': None, 'year': (np.int64(2000), 2010), 'race': ['a', 'b']})
+    assert a == b
+    hash(a)
+
+
+def test_normalized_filters_keep_ranges_and_nest():
+    assert normalized_filters({'year': (2010, 2000)}) != normalized_filters({'year': (2000, 2010)})
+    nested = normalized_filters({'selections': {'stage': {'II', 'I'}}, 'k': np.int32(3)})
+    assert nested == (('k', 3), ('selections', (('stage', ('I', 'II')),)))
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_bytes=3, sizeof=lambda value: 1)
+    for key in 'abc':
+        cache.put(key, key)
+    cache.get('a')
+    cache.put('d', 'd')
+    assert 'b' not in cache and 'a' in cache
+    assert cache.stats()['evictions'] == 1
+
+
+def test_single_flight_computes_once():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 42
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', compute))) for _ in range(5)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    while flight.stats()['coalesced'] < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert results == [42] * 5 and len(calls) == 1
@@ -0,0 +1,10 @@
+from final_app_common import natural_key, stage_key
+
+
+def test_stages_sort_in_clinical_order():
+    stages = ['UNK Stage', 'IV', 'IIB', 'I', 'IIA', '0', 'IIIC', 'III']
+    assert sorted(stages, key=stage_key) == ['0', 'I', 'IIA', 'IIB', 'III', 'IIIC', 'IV', 'UNK Stage']
+
+
+def test_age_groups_sort_by_number():
+    assert sorted(['15-24 yrs', '5-14 yrs', '85+ yrs'], key=natural_key) == ['5-14 yrs', '15-24 yrs', '85+ yrs']
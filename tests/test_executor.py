@@ -0,0 +1,37 @@
+import threading
+
+import pytest
+
+from final_app_executor import ComputeExecutor, Superseded
+
+
+def test_waiting_job_is_superseded_by_newer_submit():
+    executor = ComputeExecutor(slots=1)
+    release = threading.Event()
+    running = executor.submit('a', lambda: release.wait() and 'first')
+    stale = executor.submit('a', lambda: 'stale')
+    latest = executor.submit('a', lambda: 'latest')
+    release.set()
+    assert running.result() == 'first'
+    assert latest.result() == 'latest'
+    with pytest.raises(Superseded):
+        stale.result()
+    stats = executor.stats()
+    assert (stats['submitted'], stats['superseded'], stats['completed']) == (3, 1, 2)
+
+
+def test_cancelled_running_job_is_discarded():
+    executor = ComputeExecutor(slots=1)
+    release = threading.Event()
+    job = executor.submit('a', lambda: release.wait())
+    executor.cancel('a', job)
+    release.set()
+    with pytest.raises(Superseded):
+        job.result()
+    assert executor.stats()['discarded'] == 1
+
+
+def test_errors_reach_the_caller():
+    executor = ComputeExecutor(slots=1)
+    with pytest.raises(ZeroDivisionError):
+        executor.submit('a', lambda: 1 / 0).result()
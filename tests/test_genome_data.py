@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from final_app_genome_data import ClusterGeneStats, FILTER_KEYS, GenomeMatrix
+
+
+def genome(n_cases, n_strata):
+    rng = np.random.default_rng(4)
+    stratum = rng.integers(0, n_strata, n_cases)
+    cases = pd.DataFrame({'Case': [f'c{i}' for i in range(n_cases)], 'Cluster': stratum % 3})
+    for col in FILTER_KEYS:
+        cases[col] = pd.Series([f'{col}{s}' for s in stratum], dtype='category')
+    values = rng.normal(size=(n_cases, 5)).astype(np.float32)
+    values[rng.random(values.shape) < 0.2] = np.nan
+    return GenomeMatrix(cases, [f'g{j}' for j in range(5)], values)
+
+
+def test_stratum_sums_and_counts_match_the_cases():
+    g = genome(200, 6)
+    stats = ClusterGeneStats.build(g)
+    assert stats.sums.dtype == np.float32 and stats.counts.dtype == np.uint8
+    for i, label in enumerate(stats.strata['Cancer Stage']):
+        rows = (g.cases['Cancer Stage'] == label).to_numpy()
+        assert np.allclose(stats.sums[i], np.nansum(g.values[rows], axis=0), atol=1e-4)
+        assert (stats.counts[i] == (~np.isnan(g.values[rows])).sum(axis=0)).all()
+
+
+def test_no_statistics_when_strata_are_nearly_cases():
+    assert ClusterGeneStats.build(genome(50, 1000)) is None
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from final_app_kernels import (
+    group_box, group_codes, group_count, group_mean, group_mode, group_quantiles, group_rows, group_sum,
+)
+
+
+@pytest.fixture
+def rows():
+    rng = np.random.default_rng(0)
+    codes = rng.integers(-1, 6, 500)
+    values = rng.normal(size=(500, 9)).astype(np.float32)
+    return codes, values
+
+
+def expected_sums(codes, values, size):
+    frame = pd.DataFrame(np.asarray(values, dtype=float)[codes >= 0])
+    sums = frame.groupby(codes[codes >= 0]).sum().reindex(range(size), fill_value=0)
+    return sums.to_numpy()
+
+
+def test_group_sum_matches_groupby(rows):
+    codes, values = rows
+    assert np.allclose(group_sum(codes, values, 7), expected_sums(codes, values, 7))
+
+
+def test_group_sum_in_small_column_blocks(rows):
+    codes, values = rows
+    assert np.allclose(group_sum(codes, values, 7, block_bytes=8), expected_sums(codes, values, 7))
+
+
+def test_group_sum_counts_booleans(rows):
+    codes, values = rows
+    measured = values > 0
+    assert np.array_equal(group_sum(codes, measured, 7), expected_sums(codes, measured, 7))
+
+
+def test_group_sum_without_rows():
+    assert np.array_equal(group_sum(np.full(3, -1), np.ones((3, 2)), 2), np.zeros((2, 2)))
+    assert np.array_equal(group_sum([0, 1, 1], [1.0, 2.0, 3.0], 3), [1.0, 5.0, 0.0])
+
+
+def test_group_count_and_mean():
+    codes = np.array([0, 0, 1, -1, 2])
+    assert group_count(codes, 4).tolist() == [2, 1, 1, 0]
+    means = group_mean(codes, [1.0, np.nan, 4.0, 9.0, np.nan], 3)
+    assert means[0] == 1.0 and means[1] == 4.0 and np.isnan(means[2])
+
+
+def test_group_mode_matches_series_mode():
+    rng = np.random.default_rng(1)
+    codes = rng.integers(0, 5, 300)
+    labels = rng.integers(-1, 4, 300)
+    modes = group_mode(codes, labels, 6, 4)
+    for g in range(5):
+        labelled = pd.Series(labels[(codes == g) & (labels >= 0)])
+        assert modes[g] == labelled.mode()[0]
+    assert modes[5] == -1
+
+
+def test_group_mode_weighted():
+    assert group_mode([0, 0, 0], [1, 2, 2], 1, 3, weights=[5, 1, 1]).tolist() == [1]
+
+
+def test_group_codes_follow_groupby_order():
+    a = pd.Series(['b', 'a', 'b', None, 'a'])
+    b = pd.Series([2, 1, 1, 1, 1])
+    codes, first = group_codes(a, b)
+    assert codes.tolist() == [2, 0, 1, -1, 0]
+    assert first.tolist() == [1, 2, 0]
+    codes, _ = group_codes(a, dropna=False)
+    assert codes[3] >= 0
+
+
+def test_group_rows_keeps_row_order():
+    parts = group_rows([1, 0, 1, -1, 1], 3, np.array([True, True, False, True, True]))
+    assert [p.tolist() for p in parts] == [[1], [0, 4], []]
+
+
+def test_group_quantiles_match_numpy():
+    rng = np.random.default_rng(2)
+    codes = rng.integers(0, 4, 200)
+    values = rng.normal(size=200)
+    values[::17] = np.nan
+    quantiles = group_quantiles(codes, values, 5, [0.25, 0.5, 0.75])
+    for g in range(4):
+        assert np.allclose(quantiles[g], np.nanquantile(values[codes == g], [0.25, 0.5, 0.75]))
+    assert np.isnan(quantiles[4]).all()
+
+
+def test_group_box_whiskers_and_outliers():
+    values = np.array([1.0, 2.0, 3.0, 4.0, 100.0, 5.0, 6.0, 7.0])
+    codes = np.array([0, 0, 0, 0, 0, 1, 1, 1])
+    stats = group_box(codes, values, 2)
+    q1, q3 = np.quantile(values[:5], [0.25, 0.75])
+    assert stats['q1'][0] == q1 and stats['q3'][0] == q3
+    assert stats['lowerfence'][0] == 1.0 and stats['upperfence'][0] == 4.0
+    assert stats['outliers'].tolist() == [False, False, False, False, True, False, False, False]
+    assert stats['lowerfence'][1] == 5.0 and stats['upperfence'][1] == 7.0
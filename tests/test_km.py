@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+lifelines = pytest.importorskip('lifelines')
+from lifelines.statistics import logrank_test
+from lifelines.utils import median_survival_times
+
+from final_app_km import SurvivalTable, analyze, compact_survival
+
+
+@pytest.fixture
+def patients():
+    rng = np.random.default_rng(3)
+    n = 300
+    return pd.DataFrame({
+        'months': rng.integers(0, 60, n),
+        'dead': rng.random(n) < 0.4,
+        'group': rng.choice(['a', 'b', 'c'], n),
+    })
+
+
+def fitted(df):
+    kmf = lifelines.KaplanMeierFitter()
+    return kmf.fit(df['months'], df['dead'])
+
+
+def test_curves_and_bands_match_lifelines(patients):
+    result = analyze(SurvivalTable(patients['months'], patients['dead'], patients['group']))
+    for curve in result.curves:
+        kmf = fitted(patients[patients['group'] == curve.label])
+        assert np.array_equal(curve.timeline, kmf.survival_function_.index.to_numpy())
+        assert np.allclose(curve.survival, kmf.survival_function_.iloc[:, 0])
+        assert np.allclose(curve.lower, kmf.confidence_interval_.iloc[:, 0])
+        assert np.allclose(curve.upper, kmf.confidence_interval_.iloc[:, 1])
+
+
+def test_medians_match_lifelines(patients):
+    result = analyze(SurvivalTable(patients['months'], patients['dead'], patients['group']))
+    for label, row in result.medians.iterrows():
+        kmf = fitted(patients[patients['group'] == label])
+        interval = median_survival_times(kmf.confidence_interval_).iloc[0]
+        assert row['Median (months)'] == kmf.median_survival_time_
+        assert row['Lower 95%'] == interval.iloc[0]
+        assert row['Upper 95%'] == interval.iloc[1]
+
+
+def test_logrank_matches_lifelines(patients):
+    result = analyze(SurvivalTable(patients['months'], patients['dead'], patients['group']))
+    for a, b in [('a', 'b'), ('a', 'c'), ('b', 'c')]:
+        x, y = patients[patients['group'] == a], patients[patients['group'] == b]
+        expected = logrank_test(x['months'], y['months'], x['dead'], y['dead']).p_value
+        assert result.logrank.loc[a, b] == pytest.approx(expected)
+        assert result.logrank.loc[b, a] == pytest.approx(expected)
+    assert np.isnan(np.diag(result.logrank.to_numpy())).all()
+
+
+def test_compact_rows_give_the_same_fit(patients):
+    df = patients.assign(count=1)
+    compact = compact_survival(df)
+    assert compact['count'].sum() == len(df)
+    full = analyze(SurvivalTable(df['months'], df['dead'], df['group']))
+    weighted = analyze(SurvivalTable(compact['months'], compact['dead'], compact['group'], compact['count']))
+    for a, b in zip(full.curves, weighted.curves):
+        assert np.array_equal(a.timeline, b.timeline)
+        assert np.allclose(a.survival, b.survival) and np.allclose(a.lower, b.lower)
+    assert np.allclose(full.logrank.to_numpy(), weighted.logrank.to_numpy(), equal_nan=True)
+
+
+def test_single_curve_without_groups(patients):
+    result = analyze(SurvivalTable(patients['months'], patients['dead']))
+    assert len(result.curves) == 1 and result.logrank is None
+    assert np.allclose(result.curves[0].survival, fitted(patients).survival_function_.iloc[:, 0])
@@ -0,0 +1,91 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from final_app_storage import (
+    DatasetWriter, NULLABLE_INTEGERS, _narrow_column, columnar_is_current, columnar_path, dataset_stats,
+    dataset_version, read_dataset, stats_path, write_dataset,
+)
+
+
+@pytest.mark.parametrize('dtype', sorted(NULLABLE_INTEGERS))
+def test_integers_with_missing_values_become_nullable(dtype):
+    s = _narrow_column(pd.Series([1.0, np.nan, 3.0]), dtype)
+    assert str(s.dtype) == NULLABLE_INTEGERS[dtype]
+    assert s.isna().tolist() == [False, True, False]
+
+
+def test_nullable_column_is_kept():
+    s = pd.Series([1, None], dtype='UInt8')
+    assert _narrow_column(s, 'uint8') is s
+
+
+def test_floats_are_rounded_into_integers():
+    assert _narrow_column(pd.Series([1.0, 2.0]), 'int16').tolist() == [1, 2]
+    assert _narrow_column(pd.Series([1.0, 2.0]), 'int16').dtype == np.int16
+
+
+def test_writer_stats_match_the_written_data(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    first = pd.DataFrame({'year_of_diagnosis': [2001, 2002], 'race': ['White', None]})
+    second = pd.DataFrame({'year_of_diagnosis': [2001, 2010], 'race': ['Black', 'White']})
+    with DatasetWriter('survival df', list(first.columns)) as writer:
+        writer.write(first)
+    previous = columnar_path('survival df') + '.prev'
+    (tmp_path / 'survival df.parquet').rename(previous)
+    with DatasetWriter('survival df', list(first.columns)) as writer:
+        writer.copy_from(previous)
+        writer.write(second)
+    with open(stats_path('survival df')) as f:
+        stats = json.load(f)
+    assert stats['version'] == dataset_version('survival df')
+    expected = dataset_stats('survival df', pd.read_parquet(columnar_path('survival df')))
+    assert stats['rows'] == expected['rows'] == 4
+    for col, column in expected['columns'].items():
+        assert {k: v for k, v in stats['columns'][col].items() if k != 'values'} == \
+            {k: v for k, v in column.items() if k != 'values'}
+        assert sorted(stats['columns'][col]['values']) == sorted(column['values'])
+
+
+def test_copy_is_current_for_its_csv_whatever_the_mtimes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pd.DataFrame({'a': [1, 2]}).to_csv('t.csv', index=False)
+    assert read_dataset('t')['a'].tolist() == [1, 2]
+    assert columnar_is_current('t')
+    # A checkout leaves the CSV newer than its unchanged copy
+    os.utime('t.csv', ns=(os.stat('t.parquet').st_mtime_ns + 10**9,) * 2)
+    assert columnar_is_current('t')
+
+
+def test_copy_is_stale_after_the_csv_changes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pd.DataFrame({'a': [1, 2]}).to_csv('t.csv', index=False)
+    read_dataset('t')
+    # Same size, and an mtime older than the copy's
+    pd.DataFrame({'a': [3, 4]}).to_csv('t.csv', index=False)
+    os.utime('t.csv', ns=(os.stat('t.parquet').st_mtime_ns - 10**9,) * 2)
+    assert not columnar_is_current('t')
+    assert read_dataset('t')['a'].tolist() == [3, 4]
+
+
+def test_version_is_the_same_before_and_after_conversion(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pd.DataFrame({'a': [1, 2]}).to_csv('t.csv', index=False)
+    before = dataset_version('t')
+    read_dataset('t')
+    assert columnar_is_current('t') and dataset_version('t') == before
+    pd.DataFrame({'a': [1, 2, 3]}).to_csv('t.csv', index=False)
+    assert dataset_version('t') != before
+
+
+def test_new_data_gets_a_new_version(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pd.DataFrame({'a': [1, 2]}).to_csv('t.csv', index=False)
+    read_dataset('t')
+    before = dataset_version('t')
+    write_dataset('t', pd.DataFrame({'a': [5, 6]}))
+    assert dataset_version('t') != before
+    assert read_dataset('t')['a'].tolist() == [5, 6]
@@ -0,0 +1,49 @@
+from final_app_views import ViewSet
+
+
+def counting_views():
+    views = ViewSet(max_bytes=2**20)
+    builds = []
+
+    @views.view(inputs=['selections', 'genes'], datasets=['cases'])
+    def cases(selections, genes):
+        builds.append('cases')
+        return (selections, tuple(genes))
+
+    @views.view(inputs=['cluster'], views=['cases'])
+    def picked(cluster, cases):
+        builds.append('picked')
+        return cases, cluster
+
+    return views, builds
+
+
+def test_view_is_rebuilt_only_when_its_inputs_change(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    views, builds = counting_views()
+    state = {'selections': {'stage': ['I', 'II']}, 'genes': ['ESR1'], 'cluster': None}
+    views.get('picked', state)
+    views.get('picked', dict(state, selections={'stage': ['II', 'I']}))
+    assert builds == ['cases', 'picked']
+    views.get('picked', dict(state, cluster=2))
+    assert builds == ['cases', 'picked', 'picked']
+    views.get('picked', dict(state, genes=['ERBB2']))
+    assert builds == ['cases', 'picked', 'picked', 'cases', 'picked']
+
+
+def test_inputs_a_view_does_not_declare_do_not_change_its_key():
+    views, _ = counting_views()
+    state = {'selections': {}, 'genes': [], 'cluster': None}
+    assert views.key('cases', state) == views.key('cases', dict(state, cluster=3, expression_range=(0, 1)))
+    assert views.key('picked', state) != views.key('picked', dict(state, genes=['ESR1']))
+
+
+def test_new_data_version_rebuilds(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    views, builds = counting_views()
+    state = {'selections': {}, 'genes': [], 'cluster': None}
+    (tmp_path / 'cases.csv').write_text('a\n1\n')
+    views.get('cases', state)
+    (tmp_path / 'cases.csv').write_text('a\n1\n2\n')
+    views.get('cases', state)
+    assert builds == ['cases', 'cases']
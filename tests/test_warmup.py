@@ -0,0 +1,35 @@
+import os
+import pickle
+
+import final_app_warmup
+from final_app_warmup import SNAPSHOT_HEADER, _load_snapshot
+
+
+def write_snapshot(path, header=SNAPSHOT_HEADER, mode=0o600):
+    with open(path, 'wb') as f:
+        f.write(header)
+        pickle.dump({'key': ('v1', 42)}, f)
+    os.chmod(path, mode)
+
+
+def test_snapshot_is_loaded(tmp_path):
+    path = str(tmp_path / 'warmup.snapshot.pkl')
+    write_snapshot(path)
+    assert _load_snapshot(path) == {'key': ('v1', 42)}
+
+
+def test_snapshot_of_another_format_is_ignored(tmp_path):
+    path = str(tmp_path / 'warmup.snapshot.pkl')
+    write_snapshot(path, header=b'final_app warmup snapshot 0\n')
+    assert _load_snapshot(path) == {}
+
+
+def test_writable_snapshot_is_ignored(tmp_path):
+    path = str(tmp_path / 'warmup.snapshot.pkl')
+    write_snapshot(path, mode=0o666)
+    assert _load_snapshot(path) == {}
+
+
+def test_status_without_servers(tmp_path, monkeypatch):
+    monkeypatch.setattr(final_app_warmup, 'STATE_DIR', str(tmp_path))
+    assert final_app_warmup.status()['ready'] is False